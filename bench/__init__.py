@@ -0,0 +1,4 @@
+"""
+Бенчмарк и нагрузочный тест Music cog
+Запуск: python -m bench.run --help
+"""
@@ -0,0 +1,275 @@
+"""
+Поддельные объекты discord.py для бенчмарка
+Бот, гильдии, голосовые каналы и клиент, который читает кадры как AudioPlayer
+"""
+import asyncio
+import threading
+import time
+import types
+import logging
+
+logger = logging.getLogger('bench')
+
+# Длительность кадра, который плеер discord.py читает за раз (секунды)
+FRAME_DURATION = 0.02
+
+
+class BenchPlayer(threading.Thread):
+    """
+    Упрощённый discord.player.AudioPlayer
+
+    Читает из источника по кадру каждые FRAME_DURATION / speed секунд,
+    без кодирования и отправки по сети. После конца источника вызывает
+    after, как настоящий плеер, и закрывает источник.
+    """
+
+    def __init__(self, voice_client, source, after, speed):
+        super().__init__(daemon=True, name=f'bench-player-{voice_client.guild.id}')
+        self.voice_client = voice_client
+        self.source = source
+        self.after = after
+        self.delay = FRAME_DURATION / speed
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def run(self):
+        error = None
+        first_frame = True
+        try:
+            next_time = time.perf_counter()
+            while not self._stopped.is_set():
+                if not self._resumed.is_set():
+                    self._resumed.wait()
+                    next_time = time.perf_counter()
+                    continue
+
+                with self._lock:
+                    source = self.source
+                    data = source.read()
+                if not data:
+                    break
+                if first_frame:
+                    first_frame = False
+                    self.voice_client.stats.first_frame(self.voice_client.guild.id)
+
+                next_time += self.delay
+                time.sleep(max(0.0, next_time - time.perf_counter()))
+        except Exception as e:
+            error = e
+        finally:
+            self.voice_client.stats.source_ended(self.voice_client.guild.id)
+            self.voice_client._player_finished(self)
+            if self.after is not None:
+                try:
+                    self.after(error)
+                except Exception:
+                    logger.exception("after callback failed")
+            self.source.cleanup()
+
+    def stop(self):
+        self._stopped.set()
+        self._resumed.set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def is_playing(self):
+        return self._resumed.is_set() and not self._stopped.is_set()
+
+    def is_paused(self):
+        return not self._resumed.is_set() and not self._stopped.is_set()
+
+    def set_source(self, source):
+        with self._lock:
+            self.source = source
+
+
+class FakeVoiceClient:
+    """Голосовой клиент с интерфейсом discord.VoiceClient, который использует Music"""
+
+    def __init__(self, channel, stats, speed):
+        self.channel = channel
+        self.guild = channel.guild
+        self.stats = stats
+        self.speed = speed
+        self._player = None
+        self._connected = True
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self._player is not None and self._player.is_playing()
+
+    def is_paused(self):
+        return self._player is not None and self._player.is_paused()
+
+    def play(self, source, *, after=None):
+        if self._player is not None:
+            raise RuntimeError('Already playing audio.')
+        self._player = BenchPlayer(self, source, after, self.speed)
+        self._player.start()
+
+    def _player_finished(self, player):
+        if self._player is player:
+            self._player = None
+
+    def stop(self):
+        if self._player:
+            self._player.stop()
+            self._player = None
+
+    def pause(self):
+        if self._player:
+            self._player.pause()
+
+    def resume(self):
+        if self._player:
+            self._player.resume()
+
+    @property
+    def source(self):
+        return self._player.source if self._player else None
+
+    @source.setter
+    def source(self, value):
+        if self._player is None:
+            raise ValueError('Not playing anything.')
+        self._player.set_source(value)
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self._connected = False
+        if self.guild.voice_client is self:
+            self.guild.voice_client = None
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild, channel_id, stats, speed):
+        self.guild = guild
+        self.id = channel_id
+        self.stats = stats
+        self.speed = speed
+
+    async def connect(self, **kwargs):
+        self.guild.voice_client = FakeVoiceClient(self, self.stats, self.speed)
+        return self.guild.voice_client
+
+
+class FakeMessage:
+    def __init__(self, channel, embed=None):
+        self.channel = channel
+        self.id = id(self)
+        self.embed = embed
+
+    async def edit(self, **kwargs):
+        self.embed = kwargs.get('embed', self.embed)
+
+    async def delete(self):
+        pass
+
+
+class FakeGuild:
+    def __init__(self, guild_id, stats, speed):
+        self.id = guild_id
+        self.name = f'bench-{guild_id}'
+        self.voice_client = None
+        self.voice_channel = FakeVoiceChannel(self, guild_id * 10, stats, speed)
+
+    def get_channel(self, channel_id):
+        return self.voice_channel if channel_id == self.voice_channel.id else None
+
+
+class FakeContext:
+    """commands.Context для прямого вызова команд cog"""
+
+    def __init__(self, guild, command=None):
+        self.guild = guild
+        self.command = command
+        self.author = types.SimpleNamespace(
+            id=guild.id,
+            voice=types.SimpleNamespace(channel=guild.voice_channel)
+        )
+        self.replies = []
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def defer(self, **kwargs):
+        pass
+
+    async def send(self, content=None, **kwargs):
+        message = FakeMessage(self, kwargs.get('embed'))
+        self.replies.append(message)
+        return message
+
+
+class FakeBot:
+    """Минимальный бот: Music использует loop, гильдии и голосовые клиенты"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.guilds_by_id = {}
+        self.cogs = {}
+
+    def add_guild(self, guild):
+        self.guilds_by_id[guild.id] = guild
+
+    def get_guild(self, guild_id):
+        return self.guilds_by_id.get(guild_id)
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+    @property
+    def voice_clients(self):
+        return [guild.voice_client for guild in self.guilds_by_id.values() if guild.voice_client]
+
+    async def wait_until_ready(self):
+        pass
+
+
+class SwitchStats:
+    """
+    Паузы между треками: от конца одного источника до первого кадра следующего
+
+    Вызывается из потоков плееров.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ended = {}
+        self.gaps = []
+
+    def source_ended(self, guild_id):
+        with self._lock:
+            self._ended[guild_id] = time.perf_counter()
+
+    def first_frame(self, guild_id):
+        with self._lock:
+            ended = self._ended.pop(guild_id, None)
+            if ended is not None:
+                self.gaps.append(time.perf_counter() - ended)
+
+    def forget(self, guild_id):
+        """Остановка - не переключение"""
+        with self._lock:
+            self._ended.pop(guild_id, None)
+
+
+async def wait_idle(music, guild, timeout):
+    """Ждёт, пока гильдия доиграет очередь (или истечёт timeout)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        voice_client = guild.voice_client
+        playing = voice_client is not None and (voice_client.is_playing() or voice_client.is_paused())
+        if not playing and not music.get_queue(guild.id):
+            return True
+        await asyncio.sleep(0.2)
+    return False
@@ -0,0 +1,361 @@
+"""
+Нагрузочный тест Music cog без Discord и YouTube
+
+N гильдий одновременно выполняют /play, /skip и переключают повтор
+на поддельном голосовом клиенте; извлечение заменено заглушкой с задержкой,
+которая отдаёт локальные аудиофайлы по HTTP через настоящий ffmpeg.
+
+Пример: python -m bench.run --guilds 20 --tracks 4 --latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import logging
+from bench.fakes import FakeBot, FakeContext, FakeGuild, SwitchStats, wait_idle
+
+AUDIO_EXTENSIONS = ('.ogg', '.opus', '.webm', '.m4a', '.mp3', '.wav', '.flac')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк Music cog с заглушкой экстрактора")
+    parser.add_argument('--guilds', type=int, default=10, help="Количество гильдий")
+    parser.add_argument('--tracks', type=int, default=4, help="Сколько /play выполняет каждая гильдия")
+    parser.add_argument('--library', type=int, default=8, help="Сколько разных треков сгенерировать")
+    parser.add_argument('--track-seconds', type=float, default=8.0, help="Длительность сгенерированных треков")
+    parser.add_argument('--audio-dir', help="Папка с готовыми аудиофайлами вместо сгенерированных")
+    parser.add_argument('--latency', type=float, default=0.3, help="Задержка одного извлечения (секунды)")
+    parser.add_argument('--jitter', type=float, default=0.2, help="Разброс задержки (доля)")
+    parser.add_argument('--backend', choices=('thread', 'process'), default='thread', help="Бэкенд пула извлечения")
+    parser.add_argument('--workers', type=int, default=4, help="Потоков (процессов) извлечения")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="Во сколько раз быстрее реального времени читать кадры "
+                             "(предзагрузка при этом считает реальное время)")
+    parser.add_argument('--no-repeat', action='store_true', help="Не переключать режим повтора")
+    parser.add_argument('--timeout', type=float, default=300, help="Предел ожидания конца очереди гильдии")
+    parser.add_argument('--json', dest='json_path', help="Сохранить отчёт в JSON")
+    parser.add_argument('--verbose', action='store_true', help="Логи бота в консоль")
+    return parser.parse_args(argv)
+
+
+def percentile(values, fraction):
+    """Перцентиль по отсортированной выборке (None для пустой)"""
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 0.5),
+        'p95': percentile(values, 0.95),
+        'max': max(values) if values else None,
+    }
+
+
+def probe_duration(path, default):
+    """Длительность файла через ffprobe (или default, если ffprobe нет)"""
+    if not shutil.which('ffprobe'):
+        return default
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+        capture_output=True, text=True
+    )
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return default
+
+
+def generate_library(directory, count, seconds):
+    """Генерирует тональные Opus-файлы разной частоты"""
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f'tone-{index}.ogg')
+        subprocess.run(
+            ['ffmpeg', '-nostdin', '-y', '-loglevel', 'error',
+             '-f', 'lavfi', '-i', f'sine=frequency={220 + 55 * index}:duration={seconds}',
+             '-c:a', 'libopus', '-b:a', '96k', path],
+            check=True
+        )
+        paths.append(path)
+    return paths
+
+
+def build_library(args, workdir):
+    """Список файлов библиотеки и их длительностей"""
+    if args.audio_dir:
+        paths = sorted(
+            os.path.join(args.audio_dir, name) for name in os.listdir(args.audio_dir)
+            if name.lower().endswith(AUDIO_EXTENSIONS)
+        )
+        if not paths:
+            sys.exit(f"В {args.audio_dir} нет аудиофайлов")
+        return [(path, probe_duration(path, args.track_seconds)) for path in paths]
+
+    audio_dir = os.path.join(workdir, 'library')
+    os.makedirs(audio_dir)
+    return [(path, args.track_seconds) for path in generate_library(audio_dir, args.library, args.track_seconds)]
+
+
+def configure_environment(args, workdir):
+    """Настройки модулей utils (читаются при импорте) и заглушки"""
+    os.environ.update({
+        'YTDL_CACHE_BACKEND': 'sqlite',
+        'YTDL_CACHE_PATH': os.path.join(workdir, 'ytdl_cache.sqlite3'),
+        'STATE_PATH': os.path.join(workdir, 'state.sqlite3'),
+        'HISTORY_PATH': os.path.join(workdir, 'history.sqlite3'),
+        'HISTORY_WARM_TRACKS': '0',
+        'AUDIO_CACHE_DIR': os.path.join(workdir, 'audio'),
+        'AUDIO_CACHE_MAX_FILES': '0',
+        'YTDL_BACKEND': args.backend,
+        'YTDL_WORKERS': str(args.workers),
+        'BENCH_LATENCY': str(args.latency),
+        'BENCH_JITTER': str(args.jitter),
+        'BENCH_LIBRARY': os.path.join(workdir, 'library.json'),
+    })
+
+
+async def serve_library(files, workdir):
+    """Раздаёт файлы библиотеки по HTTP (ffmpeg читает их как стримы)"""
+    from aiohttp import web
+
+    app = web.Application()
+    directories = {}
+    for path, _ in files:
+        directories.setdefault(os.path.dirname(os.path.abspath(path)), None)
+    for index, directory in enumerate(directories):
+        directories[directory] = f'/audio{index}'
+        app.router.add_static(f'/audio{index}', directory)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    library = []
+    for index, (path, duration) in enumerate(files):
+        directory = os.path.dirname(os.path.abspath(path))
+        name = os.path.basename(path)
+        library.append({
+            'id': f'track{index}',
+            'title': os.path.splitext(name)[0],
+            'url': f'http://127.0.0.1:{port}{directories[directory]}/{name}',
+            'duration': duration,
+            'acodec': 'opus' if name.endswith(('.ogg', '.opus', '.webm')) else None,
+        })
+    with open(os.environ['BENCH_LIBRARY'], 'w', encoding='utf-8') as f:
+        json.dump(library, f)
+    return runner
+
+
+class Report:
+    """Сбор результатов прогона"""
+
+    def __init__(self):
+        self.commands = {}
+        self.errors = []
+        self.timeouts = 0
+        self.ffmpeg_samples = []
+
+    def command(self, name, seconds):
+        self.commands.setdefault(name, []).append(seconds)
+
+
+async def invoke(music, guild, report, name, **kwargs):
+    """Вызов команды cog с теми же хуками, что и у discord.py"""
+    command = next(cmd for cmd in music.get_commands() if cmd.name == name)
+    ctx = FakeContext(guild, command)
+    started = time.perf_counter()
+    try:
+        await music.cog_before_invoke(ctx)
+        await command.callback(music, ctx, **kwargs)
+    except Exception as e:
+        report.errors.append(f"{name}: {e}")
+    finally:
+        await music.cog_after_invoke(ctx)
+        report.command(name, time.perf_counter() - started)
+
+
+async def run_guild(music, guild, args, library_size, report, rng):
+    """Сценарий одной гильдии: очередь, повтор, пропуск, остановка"""
+    for _ in range(args.tracks):
+        await invoke(music, guild, report, 'play', query=f'bench song {rng.randrange(library_size)}')
+        await asyncio.sleep(rng.uniform(0, 0.2))
+
+    await asyncio.sleep(args.track_seconds / args.speed / 2)
+    if not args.no_repeat:
+        await invoke(music, guild, report, 'repeat', mode='track')
+        await asyncio.sleep(rng.uniform(0.5, 1.5))
+        await invoke(music, guild, report, 'repeat', mode='none')
+    await invoke(music, guild, report, 'skip')
+
+    if not await wait_idle(music, guild, args.timeout):
+        report.timeouts += 1
+    await invoke(music, guild, report, 'stop')
+
+
+async def sample_ffmpeg(report, count_child_processes, interval=0.25):
+    while True:
+        report.ffmpeg_samples.append(count_child_processes('ffmpeg') or 0)
+        await asyncio.sleep(interval)
+
+
+def histogram_summary(histogram, **labels):
+    """Среднее по гистограмме метрик"""
+    total = count = 0
+    for suffix, sample_labels, value in histogram.samples():
+        if dict(sample_labels).items() >= labels.items():
+            if suffix == '_sum':
+                total += value
+            elif suffix == '_count':
+                count += value
+    return {'count': count, 'mean': total / count if count else None}
+
+
+async def run(args, workdir):
+    # Модули бота читают настройки из окружения при импорте
+    from bench import stub_extractor
+    from utils import metrics
+    from utils.watchdog import LoopWatchdog
+    from utils.ytdl import metadata_cache, extraction_flights
+    import cogs.music as music_module
+
+    stub_extractor.install()
+    files = build_library(args, workdir)
+    runner = await serve_library(files, workdir)
+
+    loop = asyncio.get_running_loop()
+    bot = FakeBot(loop)
+    switches = SwitchStats()
+    watchdog = LoopWatchdog()
+    watchdog.start()
+
+    tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+
+    music = music_module.Music(bot)
+    bot.cogs['Music'] = music
+    await music.cog_load()
+
+    report = Report()
+    sampler = asyncio.create_task(sample_ffmpeg(report, metrics.count_child_processes))
+    guilds = [FakeGuild(guild_id, switches, args.speed) for guild_id in range(1, args.guilds + 1)]
+    for guild in guilds:
+        bot.add_guild(guild)
+
+    rng = random.Random(42)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_guild(music, guild, args, len(files), report, random.Random(rng.random()))
+        for guild in guilds
+    ))
+    elapsed = time.perf_counter() - started
+    memory_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # ffmpeg должны закрыться после /stop
+    await asyncio.sleep(1)
+    sampler.cancel()
+    leaked_ffmpeg = metrics.count_child_processes('ffmpeg') or 0
+
+    await music.cog_unload()
+    watchdog.stop()
+    await runner.cleanup()
+
+    extraction = histogram_summary(metrics.extraction_seconds, task='extract_in_worker')
+    extraction_wait = histogram_summary(metrics.extraction_wait_seconds, task='extract_in_worker')
+    read_summaries = [stats.summary() for stats in music.read_stats.values()]
+
+    return {
+        'guilds': args.guilds,
+        'tracks_per_guild': args.tracks,
+        'elapsed_seconds': elapsed,
+        'commands': {name: summarize(values) for name, values in report.commands.items()},
+        'command_errors': report.errors,
+        'guild_timeouts': report.timeouts,
+        'extraction_seconds': extraction,
+        'extraction_wait_seconds': extraction_wait,
+        'metadata_cache': {'hits': metadata_cache.hits, 'misses': metadata_cache.misses},
+        'coalesced_lookups': extraction_flights.coalesced,
+        'switch_gap_seconds': summarize(switches.gaps),
+        'memory_per_guild_kb': (memory_peak - memory_before) / args.guilds / 1024,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'ffmpeg_processes': {
+            'max': max(report.ffmpeg_samples, default=0),
+            'after_stop': leaked_ffmpeg,
+        },
+        'slow_reads': sum(summary['slow'] for summary in read_summaries),
+        'loop_stalls': watchdog.stats(),
+    }
+
+
+def format_ms(value):
+    return '-' if value is None else f"{value * 1000:.0f}ms"
+
+
+def print_report(result):
+    print()
+    print(f"Гильдий: {result['guilds']}, /play на гильдию: {result['tracks_per_guild']}, "
+          f"время: {result['elapsed_seconds']:.1f}s")
+    print()
+    print("Команды (p50 / p95 / max):")
+    for name, summary in sorted(result['commands'].items()):
+        print(f"  /{name:<8} x{summary['count']:<4} "
+              f"{format_ms(summary['p50'])} / {format_ms(summary['p95'])} / {format_ms(summary['max'])}")
+    if result['command_errors']:
+        print(f"  ошибок: {len(result['command_errors'])}, первая: {result['command_errors'][0]}")
+    print()
+    extraction = result['extraction_seconds']
+    print(f"Извлечение: {extraction['count']} вызовов, среднее {format_ms(extraction['mean'])}, "
+          f"ожидание воркера {format_ms(result['extraction_wait_seconds']['mean'])}")
+    cache = result['metadata_cache']
+    print(f"Кэш метаданных: {cache['hits']} попаданий / {cache['misses']} промахов, "
+          f"объединено запросов: {result['coalesced_lookups']}")
+    gap = result['switch_gap_seconds']
+    print(f"Пауза при смене трека: {gap['count']} переключений, "
+          f"p50 {format_ms(gap['p50'])}, p95 {format_ms(gap['p95'])}, max {format_ms(gap['max'])}")
+    print(f"Память: {result['memory_per_guild_kb']:.0f} КБ на гильдию (tracemalloc), "
+          f"max RSS {result['max_rss_mb']:.0f} МБ")
+    ffmpeg = result['ffmpeg_processes']
+    print(f"ffmpeg: максимум {ffmpeg['max']} процессов, после /stop {ffmpeg['after_stop']}")
+    print(f"Медленных чтений кадров: {result['slow_reads']}, "
+          f"блокировок event loop: {result['loop_stalls']['stalls']}")
+    if result['guild_timeouts']:
+        print(f"Гильдий, не доигравших очередь: {result['guild_timeouts']}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s | %(name)-12s | %(levelname)-8s | %(message)s',
+        datefmt='%H:%M:%S'
+    )
+    if not shutil.which('ffmpeg'):
+        sys.exit("Для бенчмарка нужен ffmpeg в PATH")
+
+    with tempfile.TemporaryDirectory(prefix='ellensings-bench-') as workdir:
+        configure_environment(args, workdir)
+        result = asyncio.run(run(args, workdir))
+
+    print_report(result)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Заглушка yt-dlp для бенчмарка
+Вместо YouTube отдаёт треки из локальной библиотеки с настраиваемой задержкой
+"""
+import json
+import os
+import random
+import time
+import zlib
+import utils.extractor as extractor
+
+# Настройки читаются из окружения - их получают и процессы пула (spawn)
+# Задержка одного извлечения и её разброс (доля)
+BENCH_LATENCY = float(os.getenv('BENCH_LATENCY', 0.3))
+BENCH_JITTER = float(os.getenv('BENCH_JITTER', 0.2))
+# JSON со списком треков: id, title, url, duration, acodec
+BENCH_LIBRARY = os.getenv('BENCH_LIBRARY', '')
+
+# Срок жизни ссылок на стрим, которые отдаёт заглушка
+STREAM_URL_TTL = 6 * 60 * 60
+
+_library = None
+
+
+def load_library():
+    """Библиотека треков (читается один раз на процесс)"""
+    global _library
+    if _library is None:
+        with open(BENCH_LIBRARY, encoding='utf-8') as f:
+            _library = json.load(f)
+    return _library
+
+
+def stub_url(track_id):
+    """webpage_url трека: по нему заглушка находит трек при повторном извлечении"""
+    return f"bench://track/{track_id}"
+
+
+class StubYoutubeDL:
+    """
+    Подмена YoutubeDL в потоках (процессах) пула
+
+    Поисковый запрос детерминированно выбирает трек из библиотеки,
+    ссылка bench://track/<id> - конкретный трек. Извлечение просто ждёт
+    BENCH_LATENCY секунд, как блокирующий сетевой запрос.
+    """
+
+    def __init__(self, options):
+        self.params = dict(options)
+
+    def extract_info(self, query, download=False):
+        time.sleep(max(0.0, BENCH_LATENCY * random.uniform(1 - BENCH_JITTER, 1 + BENCH_JITTER)))
+
+        library = load_library()
+        prefix = stub_url('')
+        if query.startswith(prefix):
+            track_id = query[len(prefix):]
+            entry = next((item for item in library if item['id'] == track_id), None)
+            if entry is None:
+                raise extractor.yt_dlp.DownloadError(f"ERROR: [bench] {track_id}: Video unavailable")
+        else:
+            entry = library[zlib.crc32(query.encode()) % len(library)]
+
+        expire = int(time.time()) + STREAM_URL_TTL
+        separator = '&' if '?' in entry['url'] else '?'
+        return {
+            'id': entry['id'],
+            'extractor': 'bench',
+            'extractor_key': 'Bench',
+            'title': entry['title'],
+            'uploader': 'bench',
+            'duration': entry['duration'],
+            'acodec': entry.get('acodec'),
+            'url': f"{entry['url']}{separator}expire={expire}",
+            'webpage_url': stub_url(entry['id']),
+            'epoch': int(time.time()),
+        }
+
+
+def init_stub_worker(options):
+    """Инициализатор пула: вместо YoutubeDL поток (процесс) получает заглушку"""
+    extractor._local.options = options
+    extractor._local.ytdl = StubYoutubeDL(options)
+
+
+def install():
+    """Подменяет инициализатор пула (до первого извлечения)"""
+    extractor._init_worker = init_stub_worker
@@ -3,7 +3,12 @@ EllenSings - Discord музыкальный бот в стиле Ellen Joe
 Поддерживает прокси, стабильную очередь, красивый UI
 """
 import os
+import sys
+import time
+import signal
+import asyncio
 import logging
+import subprocess
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
@@ -43,7 +48,36 @@ def get_proxy_config():
     return None, None, None
 
 
-class MusicBot(commands.Bot):
+def get_shard_config():
+    """
+    Возвращает шарды этого процесса из ENV
+
+    SHARD_COUNT - общее число шардов, SHARD_IDS - шарды этого процесса
+    (через запятую, только вместе с SHARD_COUNT). Без них discord.py сам
+    запрашивает рекомендуемое число шардов и запускает их все в одном процессе.
+
+    Returns:
+        tuple: (shard_count, shard_ids) - None, если не заданы
+    """
+    shard_count = int(os.getenv('SHARD_COUNT') or 0) or None
+    shard_ids = os.getenv('SHARD_IDS')
+    if shard_ids:
+        shard_ids = [int(shard_id) for shard_id in shard_ids.split(',') if shard_id.strip()]
+    if not shard_ids:
+        return shard_count, None
+
+    # Без общего числа шардов Discord не знает, какие гильдии отдавать этим шардам
+    if shard_count is None:
+        logger.error(f"SHARD_IDS={os.getenv('SHARD_IDS')} requires SHARD_COUNT (total shards of the whole bot)")
+        sys.exit(1)
+    invalid = [shard_id for shard_id in shard_ids if not 0 <= shard_id < shard_count]
+    if invalid:
+        logger.error(f"SHARD_IDS {invalid} out of range for SHARD_COUNT={shard_count} (valid: 0-{shard_count - 1})")
+        sys.exit(1)
+    return shard_count, shard_ids
+
+
+class MusicBot(commands.AutoShardedBot):
     """Основной класс бота с поддержкой прокси и музыки"""
 
     def __init__(self):
@@ -54,18 +88,26 @@ class MusicBot(commands.Bot):
         # Получаем конфигурацию прокси
         connector, proxy_url, proxy_auth = get_proxy_config()
 
+        # Номер процесса в кластере шардов (0 - единственный или первый)
+        self.cluster_id = int(os.getenv('CLUSTER_ID', 0))
+        shard_count, shard_ids = get_shard_config()
+
         super().__init__(
             command_prefix='!',
             intents=intents,
             help_command=None,
             connector=connector,
             proxy=proxy_url,
-            proxy_auth=proxy_auth
+            proxy_auth=proxy_auth,
+            shard_count=shard_count,
+            shard_ids=shard_ids
         )
 
         self.initial_extensions = [
             'cogs.music'
         ]
+        self.metrics_server = None
+        self.watchdog = None
 
     async def setup_hook(self):
         """Загрузка расширений и синхронизация команд"""
@@ -77,6 +119,23 @@ class MusicBot(commands.Bot):
             except Exception as e:
                 logger.error(f"✗ Failed to load {ext}: {e}")
 
+        # Постоянные кнопки панели: одна view на все гильдии, переживает перезапуск
+        music = self.get_cog('Music')
+        if music:
+            self.add_view(music.controls)
+            logger.info("✓ Registered persistent music controls")
+
+        # Сторож event loop: пишет стек, если loop надолго заблокирован
+        from utils.watchdog import LoopWatchdog
+        self.watchdog = LoopWatchdog()
+        self.watchdog.start()
+
+        await self.setup_metrics()
+
+        # Команды глобальные - их синхронизирует только первый процесс кластера
+        if self.cluster_id != 0:
+            return
+
         logger.info("Syncing slash commands...")
         try:
             synced = await self.tree.sync()
@@ -84,12 +143,84 @@ class MusicBot(commands.Bot):
         except Exception as e:
             logger.error(f"✗ Failed to sync commands: {e}")
 
+    async def setup_metrics(self):
+        """Запускает эндпоинт метрик Prometheus, если задан METRICS_PORT"""
+        # Модули utils читают настройки при импорте - только после load_dotenv
+        from utils import metrics
+        from utils.ytdl import extraction_pool, extraction_flights, metadata_cache, search_cache, audio_cache
+
+        if not metrics.METRICS_PORT:
+            return
+
+        def hit_ratio(cache):
+            total = cache.hits + cache.misses
+            return cache.hits / total if total else None
+
+        def queues():
+            music = self.get_cog('Music')
+            return music.queues.values() if music else ()
+
+        registry = metrics.registry
+        registry.gauge('discord_voice_clients', 'Connected voice clients', lambda: len(self.voice_clients))
+        registry.gauge('ffmpeg_processes', 'Running ffmpeg child processes',
+                       lambda: metrics.count_child_processes('ffmpeg'))
+        registry.gauge('music_queued_tracks', 'Tracks waiting in all guild queues',
+                       lambda: sum(len(queue) for queue in queues()))
+        registry.gauge('music_queue_length_max', 'Longest guild queue',
+                       lambda: max((len(queue) for queue in queues()), default=0))
+        registry.gauge('ytdl_pool_pending', 'Extraction requests waiting for a pool worker',
+                       lambda: extraction_pool.pending)
+        registry.counter('ytdl_coalesced_total', 'Lookups served by an extraction already in flight',
+                         lambda: extraction_flights.coalesced)
+        metadata_backend = metadata_cache.backend.name
+        registry.counter('cache_requests_total', 'Metadata, audio and search cache lookups', lambda: {
+            (('cache', 'metadata'), ('backend', metadata_backend), ('result', 'hit')): metadata_cache.hits,
+            (('cache', 'metadata'), ('backend', metadata_backend), ('result', 'miss')): metadata_cache.misses,
+            (('cache', 'audio'), ('result', 'hit')): audio_cache.hits,
+            (('cache', 'audio'), ('result', 'miss')): audio_cache.misses,
+            (('cache', 'search'), ('result', 'hit')): search_cache.hits,
+            (('cache', 'search'), ('result', 'miss')): search_cache.misses,
+        })
+        registry.counter('cache_failures_total', 'Metadata cache backend errors', lambda: {
+            (('backend', metadata_backend),): metadata_cache.backend.failures,
+        })
+        registry.gauge('cache_hit_ratio', 'Share of cache lookups that were hits', lambda: {
+            (('cache', name),): ratio
+            for name, ratio in (
+                ('metadata', hit_ratio(metadata_cache)),
+                ('audio', hit_ratio(audio_cache)),
+                ('search', hit_ratio(search_cache)),
+            )
+            if ratio is not None
+        })
+
+        # У каждого процесса кластера свой порт
+        self.metrics_server = metrics.MetricsServer(port=metrics.METRICS_PORT + self.cluster_id)
+        try:
+            await self.metrics_server.start()
+        except OSError as e:
+            logger.error(f"✗ Failed to start metrics endpoint: {e}")
+            self.metrics_server = None
+
+    async def close(self):
+        """Сохраняем очереди и историю до того, как discord.py отключится от голосовых каналов"""
+        music = self.get_cog('Music')
+        if music:
+            await music.store.close()
+            await music.history.close()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        if self.watchdog:
+            self.watchdog.stop()
+        await super().close()
+
     async def on_ready(self):
         """Событие: бот готов к работе"""
         logger.info("=" * 50)
         logger.info(f"Logged in as: {self.user}")
         logger.info(f"Bot ID: {self.user.id}")
         logger.info(f"Guilds: {len(self.guilds)}")
+        logger.info(f"Shards: {sorted(self.shards)} of {self.shard_count} (cluster {self.cluster_id})")
         logger.info("=" * 50)
 
         # Устанавливаем статус
@@ -191,6 +322,178 @@ async def ping(ctx):
     await ctx.send(embed=embed)
 
 
+@bot.command()
+@commands.is_owner()
+async def stats(ctx):
+    """Статистика аудиоконвейера по гильдиям (только для владельца)"""
+    embed = discord.Embed(
+        title="📊 Аудиоконвейер",
+        description=(
+            f"Задержка шлюза: `{round(bot.latency * 1000)}ms`\n"
+            f"Голосовых подключений: `{len(bot.voice_clients)}`\n"
+            f"Шарды процесса: `{', '.join(map(str, sorted(bot.shards)))}` из `{bot.shard_count}`"
+        ),
+        color=0x5BCEFA
+    )
+
+    if bot.watchdog:
+        watchdog = bot.watchdog.stats()
+        embed.description += (
+            f"\nБлокировок event loop: `{watchdog['stalls']}` "
+            f"(макс. `{watchdog['max_lag'] * 1000:.0f}ms`)"
+        )
+
+    music = bot.get_cog('Music')
+    guild_stats = music.read_stats if music else {}
+
+    # Сначала гильдии с наибольшим числом медленных чтений
+    for guild_id, read_stats in sorted(guild_stats.items(), key=lambda item: -item[1].slow)[:10]:
+        guild = bot.get_guild(guild_id)
+        summary = read_stats.summary()
+        embed.add_field(
+            name=guild.name if guild else str(guild_id),
+            value=(
+                f"Чтение: `{summary['avg_read_ms']:.2f}` / `{summary['max_read_ms']:.1f}ms` (сред./макс.)\n"
+                f"Медленных: `{summary['slow']}` из `{summary['reads']}`\n"
+                f"Пустых: `{summary['empty']}`, коротких: `{summary['short']}`\n"
+                f"Чтение из ffmpeg: `{summary['kbytes_per_sec']:.1f} КБ/с`"
+            ),
+            inline=True
+        )
+
+    if not guild_stats:
+        embed.add_field(name="Гильдии", value="Воспроизведения пока не было", inline=False)
+
+    await ctx.send(embed=embed)
+
+
+# ========== КЛАСТЕР ШАРДОВ ==========
+
+# Пауза между запусками процессов на каждый шард предыдущего (лимит IDENTIFY)
+SHARD_STARTUP_DELAY = 5
+# Перезапуск упавшего процесса: начальная и максимальная задержка
+RESTART_DELAY = 5
+MAX_RESTART_DELAY = 60
+# Процесс, проживший дольше этого, считается стабильным (задержка сбрасывается)
+STABLE_UPTIME = 300
+
+
+def fetch_recommended_shards(token):
+    """Рекомендуемое Discord число шардов (GET /gateway/bot)"""
+    async def fetch():
+        async with aiohttp.ClientSession() as session:
+            async with session.get(
+                'https://discord.com/api/v10/gateway/bot',
+                headers={'Authorization': f'Bot {token}'}
+            ) as response:
+                response.raise_for_status()
+                return (await response.json())['shards']
+
+    return asyncio.run(fetch())
+
+
+def split_shards(shard_count, processes):
+    """Делит шарды на непрерывные диапазоны по процессам: 5 на 2 -> [[0, 1, 2], [3, 4]]"""
+    processes = min(processes, shard_count)
+    size, extra = divmod(shard_count, processes)
+    clusters = []
+    start = 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        clusters.append(list(range(start, end)))
+        start = end
+    return clusters
+
+
+class ClusterWorker:
+    """Процесс бота с частью шардов"""
+
+    def __init__(self, cluster_id, shard_ids, shard_count):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process = None
+        self.started_at = 0.0
+        self.restart_delay = RESTART_DELAY
+        self.restart_at = None
+
+    def start(self):
+        env = {
+            **os.environ,
+            'SHARD_COUNT': str(self.shard_count),
+            'SHARD_IDS': ','.join(map(str, self.shard_ids)),
+            'CLUSTER_ID': str(self.cluster_id),
+            # Процесс кластера не запускает свой супервизор
+            'SHARD_PROCESSES': '1',
+        }
+        self.process = subprocess.Popen([sys.executable, '-u', os.path.abspath(__file__)], env=env)
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        logger.info(f"Cluster {self.cluster_id} started: shards {self.shard_ids} (pid {self.process.pid})")
+
+
+def run_cluster(token, processes):
+    """
+    Супервизор: запускает процессы с частями шардов и перезапускает упавшие
+
+    Каждый процесс - отдельный AutoShardedBot со своим event loop и GIL,
+    поэтому голос и извлечение разных гильдий расходятся по ядрам.
+    SIGTERM/SIGINT передаются процессам кластера.
+    """
+    shard_count = int(os.getenv('SHARD_COUNT') or 0) or fetch_recommended_shards(token)
+    clusters = split_shards(shard_count, processes)
+    logger.info(f"Starting shard cluster: {shard_count} shards in {len(clusters)} processes")
+
+    workers = [ClusterWorker(index, shard_ids, shard_count) for index, shard_ids in enumerate(clusters)]
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    for worker in workers:
+        if stopping:
+            break
+        worker.start()
+        # Процессы подключаются к шлюзу по очереди
+        deadline = time.monotonic() + SHARD_STARTUP_DELAY * len(worker.shard_ids)
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(0.5)
+
+    while not stopping:
+        for worker in workers:
+            if worker.process is None or worker.process.poll() is None:
+                continue
+
+            now = time.monotonic()
+            if worker.restart_at is None:
+                uptime = now - worker.started_at
+                if uptime > STABLE_UPTIME:
+                    worker.restart_delay = RESTART_DELAY
+                logger.error(
+                    f"Cluster {worker.cluster_id} exited with code {worker.process.returncode}, "
+                    f"restarting in {worker.restart_delay}s"
+                )
+                worker.restart_at = now + worker.restart_delay
+                worker.restart_delay = min(worker.restart_delay * 2, MAX_RESTART_DELAY)
+            elif now >= worker.restart_at:
+                worker.start()
+        time.sleep(1)
+
+    logger.info("Stopping shard cluster...")
+    running = [worker.process for worker in workers if worker.process and worker.process.poll() is None]
+    for process in running:
+        process.terminate()
+    for process in running:
+        try:
+            process.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
 if __name__ == '__main__':
     token = os.getenv('DISCORD_TOKEN')
 
@@ -199,6 +502,16 @@ if __name__ == '__main__':
         logger.error("Please set DISCORD_TOKEN in .env file")
         exit(1)
 
+    # Несколько процессов - запускаем супервизор кластера
+    shard_processes = int(os.getenv('SHARD_PROCESSES', 1))
+    if shard_processes > 1:
+        run_cluster(token, shard_processes)
+        sys.exit(0)
+
+    # SIGTERM (docker stop, супервизор) завершает бота так же, как Ctrl+C:
+    # bot.close() успевает сохранить очереди
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
     try:
         logger.info("Starting EllenSings bot...")
         bot.run(token, log_handler=None)  # Используем наше логирование
@@ -8,13 +8,64 @@ from discord.ext import commands
 import asyncio
 import random
 import os
+import time
+from contextlib import aclosing
 from typing import Optional, Dict, List
-from utils.ytdl import YTDLSource
-from discord.ui import View, Button
+from utils.history import HistoryStore
+from utils.persistence import QueueStore
+from utils.queue import GuildQueue
+from utils.suggest import SuggestionIndex, SUGGEST_MAX_ENTRIES
+from utils.watchdog import timed, waiting, locked, record_operation
+from utils.ytdl import (
+    CachedOpusSource, Track, ReadStats, extraction_pool, iter_playlist, search_tracks, audio_cache,
+    metadata_cache, extract_info, DEFAULT_VOLUME
+)
+from discord.ui import View, Button, Select
 import logging
 
 logger = logging.getLogger('music')
 
+# За сколько секунд до конца трека готовить следующий
+PREFETCH_LEAD = 15
+# Максимум треков в очереди одной гильдии
+MAX_QUEUE_LENGTH = int(os.getenv('MAX_QUEUE_LENGTH', 500))
+# Панель Now Playing редактируется не чаще раза в столько секунд
+PANEL_UPDATE_INTERVAL = 2.0
+# Трек, закончившийся быстрее этого (секунды), считаем упавшим источником
+EARLY_END_SECONDS = 2
+# После стольких падений подряд трек убирается из повтора
+MAX_TRACK_FAILURES = 2
+# Шаг /forward и /rewind по умолчанию (секунды)
+SEEK_STEP = 10
+# Треков на одной странице /queue
+QUEUE_PAGE_SIZE = 10
+# Сколько популярных треков прогревать в кэше при запуске и за какой период (дни)
+HISTORY_WARM_TRACKS = int(os.getenv('HISTORY_WARM_TRACKS', 20))
+HISTORY_WARM_DAYS = 7
+
+
+def parse_timestamp(text: str) -> Optional[int]:
+    """Разбирает время вида `90`, `1:30` или `1:02:03` в секунды (None - неверный формат)"""
+    parts = text.strip().split(':')
+    if not 1 <= len(parts) <= 3 or not all(part.isdigit() for part in parts):
+        return None
+    # Минуты и секунды после первого поля - не больше 59 (`1:99` - опечатка)
+    if any(int(part) >= 60 for part in parts[1:]):
+        return None
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def format_timestamp(seconds: float) -> str:
+    """Форматирует секунды как `м:сс` или `ч:мм:сс`"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
 
 class QueuePaginator(View):
     """Пагинация для отображения очереди треков"""
@@ -45,18 +96,17 @@ class QueuePaginator(View):
             )
 
         # Следующие треки с пагинацией
-        items_per_page = 10
-        start = self.page * items_per_page
-        end = start + items_per_page
-        page_queue = queue[start:end]
+        start = self.page * QUEUE_PAGE_SIZE
+        page_queue = queue.page(start, QUEUE_PAGE_SIZE)
 
         if page_queue:
             queue_text = "\n".join([
                 f"`{start + i + 1}.` {track.title}"
                 for i, track in enumerate(page_queue)
             ])
+            total = f", {format_timestamp(queue.total_duration)}" if queue.total_duration else ""
             embed.add_field(
-                name=f"📃 Следующие ({len(queue)} треков всего)",
+                name=f"📃 Следующие ({len(queue)} треков всего{total})",
                 value=queue_text,
                 inline=False
             )
@@ -81,7 +131,7 @@ class QueuePaginator(View):
     @discord.ui.button(label="▶️", style=discord.ButtonStyle.grey)
     async def next_page(self, interaction: discord.Interaction, button: Button):
         queue = self.cog.get_queue(self.guild_id)
-        max_page = (len(queue) - 1) // 10
+        max_page = (len(queue) - 1) // QUEUE_PAGE_SIZE
         if self.page < max_page:
             self.page += 1
             await interaction.response.edit_message(embed=self.get_queue_embed(), view=self)
@@ -89,26 +139,137 @@ class QueuePaginator(View):
             await interaction.response.defer()
 
 
+class SearchResults(View):
+    """
+    Меню выбора трека из результатов /search
+
+    Результаты плоские (без форматов): ссылку на стрим получит только
+    выбранный трек, когда дойдёт до воспроизведения.
+    """
+    def __init__(self, cog, author_id: int, results: list):
+        super().__init__(timeout=60)
+        self.cog = cog
+        self.author_id = author_id
+        self.results = results
+        self.message = None
+
+        select = Select(placeholder="Выберите трек", options=[
+            discord.SelectOption(
+                label=entry['title'][:100],
+                description=self.describe(entry)[:100] or None,
+                value=str(i)
+            )
+            for i, entry in enumerate(results)
+        ])
+        select.callback = self.on_select
+        self.add_item(select)
+
+    @staticmethod
+    def describe(entry: dict) -> str:
+        parts = []
+        if entry.get('duration'):
+            parts.append(format_timestamp(entry['duration']))
+        if entry.get('uploader') and entry['uploader'] != 'Unknown':
+            parts.append(entry['uploader'])
+        return " · ".join(parts)
+
+    def get_results_embed(self, query: str) -> discord.Embed:
+        """Создаёт embed со списком найденных треков"""
+        embed = discord.Embed(
+            title="🔎 Результаты поиска",
+            description="\n".join(
+                f"`{i + 1}.` {entry['title']}" + (f" — {self.describe(entry)}" if self.describe(entry) else "")
+                for i, entry in enumerate(self.results)
+            ),
+            color=0x5BCEFA
+        )
+        embed.set_footer(text=f"EllenSings • {query}"[:2048])
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("❌ Это меню другого пользователя", ephemeral=True, delete_after=3)
+            return False
+        return True
+
+    async def on_select(self, interaction: discord.Interaction):
+        entry = self.results[int(interaction.data['values'][0])]
+        guild_id = interaction.guild_id
+        self.stop()
+
+        if not interaction.guild.voice_client:
+            embed = discord.Embed(
+                title="❌ Ошибка",
+                description="Бот больше не в голосовом канале",
+                color=0xFF6B6B
+            )
+            return await interaction.response.edit_message(embed=embed, view=None)
+
+        if self.cog.queue_is_full(guild_id):
+            embed = discord.Embed(
+                title="❌ Очередь заполнена",
+                description=f"В очереди уже {MAX_QUEUE_LENGTH} треков",
+                color=0xFF6B6B
+            )
+            return await interaction.response.edit_message(embed=embed, view=None)
+
+        queue = self.cog.get_queue(guild_id)
+        queue.append(Track(dict(entry), requester=interaction.user.id))
+
+        embed = discord.Embed(
+            title="✅ Добавлено в очередь",
+            description=f"**{entry['title']}**",
+            color=0x98D8C8
+        )
+        embed.add_field(name="Позиция", value=f"#{len(queue)}", inline=True)
+        embed.set_footer(text="EllenSings")
+        await interaction.response.edit_message(embed=embed, view=None)
+
+        await self.cog.process_queue(guild_id)
+
+    async def on_timeout(self):
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+
 class MusicControls(View):
-    """Кнопки управления воспроизведением в стиле Ellen Joe"""
-    def __init__(self, cog, guild_id: int):
+    """
+    Кнопки управления воспроизведением в стиле Ellen Joe
+
+    Одна постоянная view на всех: гильдия берётся из interaction.guild_id,
+    а действия передаются текущему Music cog. Регистрируется через
+    bot.add_view в MusicBot.setup_hook, поэтому кнопки работают и после перезапуска.
+    """
+    def __init__(self):
         super().__init__(timeout=None)
-        self.cog = cog
-        self.guild_id = guild_id
+
+    @staticmethod
+    def get_cog(interaction: discord.Interaction) -> Optional['Music']:
+        return interaction.client.get_cog('Music')
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        cog = self.get_cog(interaction)
+        if interaction.guild_id is None or cog is None:
+            await interaction.response.send_message("❌ Музыкальный модуль недоступен", ephemeral=True, delete_after=3)
+            return False
+        await cog.restore_guild(interaction.guild_id)
+        return True
 
     @discord.ui.button(emoji="⏯️", style=discord.ButtonStyle.primary, custom_id="play_pause")
     async def play_pause_btn(self, interaction: discord.Interaction, button: Button):
         """Пауза/Возобновление"""
-        await self.cog.toggle_play_pause(self.guild_id)
+        cog = self.get_cog(interaction)
+        await cog.toggle_play_pause(interaction.guild_id)
         await interaction.response.defer()
-        await self.cog.update_now_playing(self.guild_id)
+        await cog.update_now_playing(interaction.guild_id)
 
     @discord.ui.button(emoji="⏭️", style=discord.ButtonStyle.secondary, custom_id="skip")
     async def skip_btn(self, interaction: discord.Interaction, button: Button):
         """Пропуск трека"""
-        guild = self.cog.bot.get_guild(self.guild_id)
-        if guild and guild.voice_client:
-            guild.voice_client.stop()
+        if self.get_cog(interaction).skip_current(interaction.guild_id):
             await interaction.response.send_message("⏭️ Трек пропущен", ephemeral=True, delete_after=3)
         else:
             await interaction.response.send_message("❌ Ничего не играет", ephemeral=True, delete_after=3)
@@ -116,16 +277,19 @@ class MusicControls(View):
     @discord.ui.button(emoji="⏹️", style=discord.ButtonStyle.danger, custom_id="stop")
     async def stop_btn(self, interaction: discord.Interaction, button: Button):
         """Остановка и очистка"""
-        await self.cog.stop_playback(self.guild_id)
+        await self.get_cog(interaction).stop_playback(interaction.guild_id)
         await interaction.response.send_message("⏹️ Воспроизведение остановлено", ephemeral=True, delete_after=3)
 
     @discord.ui.button(emoji="🔁", style=discord.ButtonStyle.secondary, custom_id="repeat")
     async def repeat_btn(self, interaction: discord.Interaction, button: Button):
         """Переключение режима повтора"""
+        cog = self.get_cog(interaction)
+        guild_id = interaction.guild_id
         modes = ['none', 'track', 'queue']
-        current = self.cog.repeat_mode.get(self.guild_id, 'none')
+        current = cog.repeat_mode.get(guild_id, 'none')
         next_mode = modes[(modes.index(current) + 1) % len(modes)]
-        self.cog.repeat_mode[self.guild_id] = next_mode
+        cog.repeat_mode[guild_id] = next_mode
+        cog.save_state(guild_id)
 
         mode_names = {'none': 'Без повтора', 'track': 'Повтор трека', 'queue': 'Повтор очереди'}
         await interaction.response.send_message(
@@ -133,12 +297,12 @@ class MusicControls(View):
             ephemeral=True,
             delete_after=3
         )
-        await self.cog.update_now_playing(self.guild_id)
+        await cog.update_now_playing(guild_id)
 
     @discord.ui.button(emoji="📃", style=discord.ButtonStyle.secondary, custom_id="queue")
     async def queue_btn(self, interaction: discord.Interaction, button: Button):
         """Показать очередь"""
-        paginator = QueuePaginator(self.cog, self.guild_id)
+        paginator = QueuePaginator(self.get_cog(interaction), interaction.guild_id)
         await interaction.response.send_message(
             embed=paginator.get_queue_embed(),
             view=paginator,
@@ -146,24 +310,339 @@ class MusicControls(View):
         )
 
 
+class NowPlayingPanel:
+    """
+    Панель Now Playing одной гильдии
+
+    Изменения состояния только помечают панель устаревшей; сообщение
+    редактируется не чаще раза в PANEL_UPDATE_INTERVAL секунд и только если
+    embed действительно изменился. Кнопки - общая постоянная MusicControls.
+    """
+
+    def __init__(self, cog, guild_id: int, message: discord.Message, embed: Optional[discord.Embed] = None):
+        self.cog = cog
+        self.guild_id = guild_id
+        self.message = message
+        self.last_rendered = embed.to_dict() if embed else None
+        self.last_flush = time.monotonic()
+        self.dirty = False
+        self._task: Optional[asyncio.Task] = None
+
+    def attach(self, message: discord.Message, embed: discord.Embed):
+        """Переключает панель на новое сообщение"""
+        self.message = message
+        self.last_rendered = embed.to_dict()
+        self.last_flush = time.monotonic()
+
+    def mark_dirty(self):
+        """Запланировать обновление (несколько вызовов подряд дают одно редактирование)"""
+        self.dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self.dirty:
+            delay = self.last_flush + PANEL_UPDATE_INTERVAL - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.dirty = False
+            await self.flush()
+
+    async def flush(self):
+        """Редактирует сообщение, если embed изменился с прошлой отправки"""
+        self.last_flush = time.monotonic()
+        embed = self.cog.build_now_playing_embed(self.guild_id)
+        if embed is None:
+            return
+
+        rendered = embed.to_dict()
+        if rendered == self.last_rendered:
+            return
+
+        try:
+            # Кнопки не меняются - отправляем только embed
+            await self.message.edit(embed=embed)
+            self.last_rendered = rendered
+        except (discord.NotFound, discord.HTTPException):
+            # Сообщение удалено - панель больше не обновляем
+            if self.cog.panels.get(self.guild_id) is self:
+                del self.cog.panels[self.guild_id]
+
+    async def delete(self):
+        """Останавливает обновления и удаляет сообщение панели"""
+        if self._task:
+            self._task.cancel()
+        try:
+            await self.message.delete()
+        except (discord.NotFound, discord.HTTPException):
+            pass
+
+
 class Music(commands.Cog):
     """Основной музыкальный модуль с улучшенной стабильностью"""
 
     def __init__(self, bot):
         self.bot = bot
         # Состояние для каждой гильдии
-        self.queues: Dict[int, List] = {}
-        self.current: Dict[int, discord.PCMVolumeTransformer] = {}
+        self.queues: Dict[int, GuildQueue] = {}
+        self.current: Dict[int, discord.AudioSource] = {}
         self.repeat_mode: Dict[int, str] = {}  # 'none', 'track', 'queue'
         self.queue_locks: Dict[int, asyncio.Lock] = {}
         self.inactive_timers: Dict[int, asyncio.Task] = {}
-        self.now_playing_messages: Dict[int, discord.Message] = {}
+        self.panels: Dict[int, NowPlayingPanel] = {}
+        # Общая для всех гильдий панель кнопок (регистрируется в MusicBot.setup_hook)
+        self.controls = MusicControls()
+        # Сохранение очередей между перезапусками
+        self.store = QueueStore()
+        self.restored: set = set()
+        self.restore_task: Optional[asyncio.Task] = None
+        # Запуск восстановленной очереди по первой команде (идёт в фоне)
+        self.restore_playback: Dict[int, asyncio.Task] = {}
+        # Предзагрузка следующего трека: фоновая задача и прогретый источник
+        self.prefetch_tasks: Dict[int, asyncio.Task] = {}
+        self.prefetched: Dict[int, discord.AudioSource] = {}
+        # Для распознавания источников, которые сразу же закончились
+        self.started_at: Dict[int, float] = {}
+        # Время начала воспроизведения для истории (перемотка его не сбрасывает)
+        self.play_started: Dict[int, float] = {}
+        self.skip_requested: set = set()
+        # /skipto: закончившийся трек не возвращается в очередь по режиму повтора
+        self.jump_requested: set = set()
+        # Статистика чтения кадров из ffmpeg по гильдиям (!stats)
+        self.read_stats: Dict[int, ReadStats] = {}
+        # Подсказки для /play: названия из кэша метаданных и история гильдий
+        self.suggestions = SuggestionIndex()
+        self.suggestions_task: Optional[asyncio.Task] = None
+        # История прослушиваний (/top, /history, прогрев кэшей)
+        self.history = HistoryStore()
+        self.warm_task: Optional[asyncio.Task] = None
 
         logger.info("Music cog loaded")
 
-    def get_queue(self, guild_id: int) -> List:
+    async def cog_load(self):
+        """Заранее поднимаем пул извлечения, индекс аудиокэша и сохранённые очереди"""
+        await extraction_pool.start()
+        await audio_cache.start()
+        await self.store.open(self.snapshot_state, self.playing_positions)
+        await self.history.open()
+        self.restore_task = asyncio.create_task(self.restore_sessions())
+        self.suggestions_task = asyncio.create_task(self.build_suggestions())
+        self.warm_task = asyncio.create_task(self.warm_caches())
+
+    async def cog_unload(self):
+        """Сохраняем последние изменения очередей"""
+        if self.restore_task:
+            self.restore_task.cancel()
+        for task in self.restore_playback.values():
+            task.cancel()
+        if self.suggestions_task:
+            self.suggestions_task.cancel()
+        if self.warm_task:
+            self.warm_task.cancel()
+        await self.store.close()
+        await self.history.close()
+
+    async def cog_before_invoke(self, ctx: commands.Context):
+        """Очередь гильдии восстанавливается при первом обращении к ней"""
+        ctx.music_started_at = time.perf_counter()
+        if ctx.guild:
+            await self.restore_guild(ctx.guild.id)
+
+    async def cog_after_invoke(self, ctx: commands.Context):
+        """Замер длительности успешной команды"""
+        self.record_command(ctx)
+
+    async def cog_command_error(self, ctx: commands.Context, error: commands.CommandError):
+        """
+        Замер длительности команды, завершившейся ошибкой
+
+        При вызове гибридной команды через slash after_invoke после ошибки
+        не вызывается. Обработка ошибки остаётся за on_command_error бота.
+        """
+        self.record_command(ctx)
+
+    def record_command(self, ctx: commands.Context):
+        """Записывает длительность команды один раз (префиксная команда вызывает оба хука)"""
+        started = getattr(ctx, 'music_started_at', None)
+        if started is not None:
+            ctx.music_started_at = None
+            record_operation(f"command:{ctx.command.qualified_name}", time.perf_counter() - started)
+
+    async def build_suggestions(self):
+        """Наполняет индекс подсказок треками из кэша метаданных и историей гильдий"""
+        await self.suggestions.build(await metadata_cache.recent(SUGGEST_MAX_ENTRIES))
+        for guild_id, key, title, url, plays in await self.history.play_counts(SUGGEST_MAX_ENTRIES):
+            self.suggestions.record_play(guild_id, key, title, url, plays)
+
+    async def warm_caches(self):
+        """
+        Прогревает кэши популярными треками из истории
+
+        Аудиокэш узнаёт, сколько раз играли треки до перезапуска, а для треков
+        без записи в кэше метаданных она заполняется заранее, по одному
+        извлечению за раз.
+        """
+        if HISTORY_WARM_TRACKS <= 0:
+            return
+
+        since = time.time() - HISTORY_WARM_DAYS * 24 * 3600
+        popular = await self.history.popular(limit=HISTORY_WARM_TRACKS, since=since)
+        audio_cache.seed_plays((key, plays) for key, _, plays in popular)
+
+        for _, url, _ in popular:
+            if not url:
+                continue
+            try:
+                await extract_info(url, metadata_only=True)
+            except Exception as e:
+                logger.debug(f"Cache warm-up failed for {url}: {e}")
+        if popular:
+            logger.info(f"Warmed caches with {len(popular)} popular tracks")
+
+    def record_history(self, guild_id: int, player: discord.AudioSource, completed: bool):
+        """Записывает закончившееся воспроизведение в историю"""
+        track = player.track
+        ended = time.time()
+        started = self.play_started.pop(guild_id, ended)
+        self.history.record(
+            guild_id, track.key, track.title, track.webpage_url,
+            duration=track.duration, requester=track.requester,
+            started=started, ended=ended, completed=completed
+        )
+
+    # ========== СОХРАНЕНИЕ СОСТОЯНИЯ ==========
+
+    def save_state(self, guild_id: int):
+        """Запланировать сохранение состояния гильдии (запись идёт пачками в фоне)"""
+        self.store.mark_dirty(guild_id)
+
+    def playing_positions(self) -> Dict[int, float]:
+        """Позиции треков в гильдиях, где сейчас играет (или стоит на паузе) трек"""
+        positions = {}
+        for guild_id, current in self.current.items():
+            guild = self.bot.get_guild(guild_id)
+            voice_client = guild.voice_client if guild else None
+            if voice_client and (voice_client.is_playing() or voice_client.is_paused()):
+                positions[guild_id] = round(current.position, 2)
+        return positions
+
+    def snapshot_state(self, guild_id: int) -> Optional[dict]:
+        """
+        Снимок состояния гильдии для сохранения
+
+        В снимок попадают только info dict треков, не FFmpeg-источники.
+
+        Returns:
+            dict или None, если сохранять нечего
+        """
+        queue = self.queues.get(guild_id) or GuildQueue()
+        current = self.current.get(guild_id)
+        guild = self.bot.get_guild(guild_id)
+        voice_client = guild.voice_client if guild else None
+        playing = voice_client is not None and (voice_client.is_playing() or voice_client.is_paused())
+
+        if not queue and not playing:
+            return None
+
+        # Позиция играющего трека или отложенного после обрыва соединения
+        if current and playing:
+            position = current.position
+        else:
+            position = queue[0].resume_at if queue else 0
+
+        panel = self.panels.get(guild_id)
+        channel = getattr(voice_client, 'channel', None)
+        return {
+            'voice_channel_id': channel.id if channel else None,
+            'repeat_mode': self.repeat_mode.get(guild_id, 'none'),
+            'current': current.track.data if current and playing else None,
+            'position': round(position, 2),
+            'queue': [track.data for track in queue],
+            'panel': [panel.message.channel.id, panel.message.id] if panel else None,
+        }
+
+    async def restore_guild(self, guild_id: int, *, reconnect: bool = False):
+        """
+        Восстанавливает сохранённую очередь гильдии (один раз за запуск)
+
+        Ждать приходится только чтения очереди из локальной базы: без
+        reconnect (первая команда или кнопка) первый трек запускается в фоне,
+        чтобы извлечение не съело 3 секунды, которые Discord даёт на ответ.
+
+        Args:
+            reconnect: Заново подключиться к голосовому каналу и продолжить воспроизведение
+        """
+        if guild_id in self.restored:
+            return
+        self.restored.add(guild_id)
+
+        state = await self.store.load(guild_id)
+        guild = self.bot.get_guild(guild_id)
+        if not state or not guild:
+            return
+
+        voice_client = guild.voice_client
+        tracks = [Track(data) for data in state.get('queue', [])]
+        resume_at = state.get('position') or 0.0
+        if state.get('current'):
+            if voice_client and (voice_client.is_playing() or voice_client.is_paused()):
+                resume_at = 0.0
+            else:
+                # Прерванный трек играет первым
+                tracks.insert(0, Track(state['current']))
+        if tracks:
+            # ...с того места, где остановился
+            tracks[0].resume_at = resume_at
+
+        # Треки, добавленные до восстановления, остаются в конце
+        self.get_queue(guild_id).prepend(tracks)
+        self.repeat_mode.setdefault(guild_id, state.get('repeat_mode', 'none'))
+
+        if state.get('panel') and guild_id not in self.panels:
+            channel_id, message_id = state['panel']
+            channel = guild.get_channel(channel_id)
+            if channel:
+                message = channel.get_partial_message(message_id)
+                self.panels[guild_id] = NowPlayingPanel(self, guild_id, message)
+
+        logger.info(f"Restored {len(tracks)} tracks in guild {guild_id}")
+
+        if not reconnect:
+            task = self.restore_playback[guild_id] = asyncio.create_task(self.process_queue(guild_id))
+            task.add_done_callback(lambda _: self.restore_playback.pop(guild_id, None))
+            return
+
+        if state.get('voice_channel_id') and not voice_client:
+            channel = guild.get_channel(state['voice_channel_id'])
+            if channel:
+                try:
+                    await channel.connect()
+                    logger.info(f"Reconnected to voice channel in guild {guild_id}")
+                except Exception as e:
+                    logger.error(f"Failed to reconnect to voice in guild {guild_id}: {e}")
+
+        await self.process_queue(guild_id)
+
+    async def restore_sessions(self):
+        """После запуска возвращает в голосовые каналы гильдии, где шло воспроизведение"""
+        await self.bot.wait_until_ready()
+        for guild_id, voice_channel_id in self.store.saved_guilds().items():
+            if voice_channel_id:
+                await self.restore_guild(guild_id, reconnect=True)
+
+    def get_queue(self, guild_id: int) -> GuildQueue:
         """Получить очередь для гильдии"""
-        return self.queues.setdefault(guild_id, [])
+        queue = self.queues.get(guild_id)
+        if queue is None:
+            queue = self.queues[guild_id] = GuildQueue()
+        return queue
+
+    def get_read_stats(self, guild_id: int) -> ReadStats:
+        """Статистика чтения аудио гильдии (общая для всех её треков)"""
+        stats = self.read_stats.get(guild_id)
+        if stats is None:
+            stats = self.read_stats[guild_id] = ReadStats()
+        return stats
 
     def get_lock(self, guild_id: int) -> asyncio.Lock:
         """Получить lock для очереди гильдии"""
@@ -171,13 +650,17 @@ class Music(commands.Cog):
             self.queue_locks[guild_id] = asyncio.Lock()
         return self.queue_locks[guild_id]
 
+    @timed('process_queue')
     async def process_queue(self, guild_id: int):
         """
         ЕДИНАЯ точка обработки очереди с lock для предотвращения race conditions
         """
         lock = self.get_lock(guild_id)
+        self.save_state(guild_id)
 
-        async with lock:
+        # Замер process_queue - только работа в loop: ожидание блокировки,
+        # извлечения и Discord в него не входит
+        async with locked(lock):
             guild = self.bot.get_guild(guild_id)
             if not guild:
                 return
@@ -192,16 +675,33 @@ class Music(commands.Cog):
 
             queue = self.get_queue(guild_id)
 
+            # Берём следующий трек и только сейчас создаём для него FFmpeg
+            # (если он уже подготовлен предзагрузкой - используем готовый)
+            self.cancel_prefetch(guild_id)
+            prefetched = self.prefetched.pop(guild_id, None)
+            player = None
+            while queue and player is None:
+                track = queue.popleft()
+                if prefetched and prefetched.track is track:
+                    player, prefetched = prefetched, None
+                    break
+                try:
+                    async with waiting('resolve'):
+                        player = await track.resolve(guild_id=guild_id)
+                except Exception as e:
+                    logger.error(f"Failed to start {track.title} in guild {guild_id}: {e}")
+
+            if prefetched:
+                prefetched.cleanup()
+
             # Если очередь пуста - запускаем таймер отключения
-            if not queue:
+            if player is None:
                 self.start_inactivity_timer(guild_id)
                 return
 
             # Отменяем таймер, если он был
             self.cancel_inactivity_timer(guild_id)
 
-            # Берём следующий трек
-            player = queue.pop(0)
             self.current[guild_id] = player
 
             # Запускаем воспроизведение
@@ -210,36 +710,273 @@ class Music(commands.Cog):
                     logger.error(f"Playback error in guild {guild_id}: {error}")
                 # Запускаем обработку следующего трека
                 asyncio.run_coroutine_threadsafe(
-                    self.handle_track_end(guild_id),
+                    self.handle_track_end(guild_id, error),
                     self.bot.loop
                 )
 
+            self.skip_requested.discard(guild_id)
+            self.started_at[guild_id] = time.monotonic()
+            self.play_started[guild_id] = time.time()
+            player.read_stats = self.get_read_stats(guild_id)
             voice_client.play(player, after=after_play)
             logger.info(f"Playing: {player.title} in guild {guild_id}")
+            self.suggestions.record_play(guild_id, player.track.key, player.title, player.track.webpage_url)
+
+            # Часто играемые треки скачиваются в локальный кэш
+            if not isinstance(player, CachedOpusSource):
+                audio_cache.note_play(player.track.key, player.data, DEFAULT_VOLUME)
+
+            # Готовим следующий трек незадолго до конца текущего
+            if player.duration:
+                self.prefetch_tasks[guild_id] = asyncio.create_task(
+                    self.prefetch_next(guild_id, player)
+                )
 
             # Обновляем панель Now Playing
-            await self.update_now_playing(guild_id)
+            async with waiting():
+                await self.update_now_playing(guild_id)
 
-    async def handle_track_end(self, guild_id: int):
+    @timed('handle_track_end')
+    async def handle_track_end(self, guild_id: int, error: Optional[Exception] = None):
         """
         Обработка окончания трека с учётом режима повтора
+
+        Для повтора в очередь возвращается Track, а не отыгравший источник:
+        перед следующим воспроизведением из него создаётся новый FFmpeg
+        (из аудиокэша или по ещё действующей ссылке, без извлечения).
         """
         current_track = self.current.get(guild_id)
+        jumped = guild_id in self.jump_requested
+        self.jump_requested.discard(guild_id)
 
-        # Обработка режима повтора
+        # Соединение оборвалось посреди трека - он доиграет после переподключения
+        if current_track and self.check_interrupted(guild_id, current_track):
+            return
+
+        # До check_dead_source: она сбрасывает время старта и флаг пропуска
         if current_track:
+            completed = (error is None and guild_id not in self.skip_requested
+                         and current_track.position >= current_track.track.duration - EARLY_END_SECONDS)
+            self.record_history(guild_id, current_track, completed)
+
+        # Обработка режима повтора
+        if current_track and not self.check_dead_source(guild_id, current_track, error) and not jumped:
             repeat = self.repeat_mode.get(guild_id, 'none')
 
             if repeat == 'track':
                 # Повтор текущего трека - добавляем в начало очереди
-                self.get_queue(guild_id).insert(0, current_track)
+                self.get_queue(guild_id).appendleft(current_track.track)
             elif repeat == 'queue':
                 # Повтор очереди - добавляем в конец
-                self.get_queue(guild_id).append(current_track)
+                self.get_queue(guild_id).append(current_track.track)
 
         # Обрабатываем следующий трек
         await self.process_queue(guild_id)
 
+    def check_interrupted(self, guild_id: int, player: discord.AudioSource) -> bool:
+        """
+        Проверяет, что трек остановился из-за потери голосового соединения
+
+        Такой трек возвращается в начало очереди с текущей позицией:
+        после переподключения он продолжится с этого места (ffmpeg -ss),
+        а не с начала.
+
+        Returns:
+            bool: True, если трек отложен до переподключения
+        """
+        if guild_id in self.skip_requested:
+            return False
+
+        guild = self.bot.get_guild(guild_id)
+        voice_client = guild.voice_client if guild else None
+        if voice_client and voice_client.is_connected():
+            return False
+
+        position = player.position
+        if player.duration and position >= player.duration - EARLY_END_SECONDS:
+            return False
+
+        track = player.track
+        track.resume_at = position
+        self.get_queue(guild_id).appendleft(track)
+        self.current.pop(guild_id, None)
+        self.started_at.pop(guild_id, None)
+        self.play_started.pop(guild_id, None)
+        self.cancel_prefetch(guild_id)
+        self.discard_prefetched(guild_id)
+        self.save_state(guild_id)
+        logger.info(f"Voice connection lost in guild {guild_id}, {track.title} will resume at {position:.0f}s")
+        return True
+
+    def check_dead_source(self, guild_id: int, player: discord.AudioSource, error: Optional[Exception]) -> bool:
+        """
+        Проверяет, что источник оборвался сразу после старта (например, ссылка умерла)
+
+        Такой трек при следующем запуске заново получает ссылку в обход кэша,
+        а после MAX_TRACK_FAILURES падений подряд не возвращается в повтор,
+        чтобы не крутиться в цикле мгновенных перезапусков.
+
+        Returns:
+            bool: True, если трек не нужно повторять
+        """
+        track = player.track
+        played = time.monotonic() - self.started_at.pop(guild_id, time.monotonic())
+        skipped = guild_id in self.skip_requested
+        self.skip_requested.discard(guild_id)
+
+        # Перемотка к самому концу трека - не падение
+        ended_early = (track.duration > EARLY_END_SECONDS and played < EARLY_END_SECONDS
+                       and player.position < track.duration - EARLY_END_SECONDS)
+        dead = (error is not None or ended_early) and not skipped
+        if not dead:
+            track.failures = 0
+            return False
+
+        track.mark_stale()
+        track.failures += 1
+        logger.warning(f"Source died early: {track.title} in guild {guild_id} (attempt {track.failures})")
+
+        if track.failures >= MAX_TRACK_FAILURES:
+            logger.warning(f"Removing {track.title} from repeat in guild {guild_id}: source keeps failing")
+            return True
+        return False
+
+    async def seek_current(self, guild_id: int, position: float) -> Optional[float]:
+        """
+        Перематывает текущий трек на position секунд
+
+        Для трека создаётся новый источник с -ss на входе ffmpeg (переход
+        по ключевым кадрам без декодирования пропущенного) из уже известных
+        метаданных, без повторного извлечения. Новый источник подменяет
+        старый прямо в играющем плеере, поэтому очередь и after-колбэк
+        не затрагиваются и паузы между источниками нет. Перемотка на паузе
+        паузу сохраняет.
+
+        Returns:
+            float: Фактическая позиция или None, если ничего не играет
+        """
+        guild = self.bot.get_guild(guild_id)
+        voice_client = guild.voice_client if guild else None
+        current = self.current.get(guild_id)
+        if not current or not voice_client or not (voice_client.is_playing() or voice_client.is_paused()):
+            return None
+
+        position = max(position, 0)
+        if current.duration:
+            position = min(position, max(current.duration - EARLY_END_SECONDS, 0))
+
+        async with self.get_lock(guild_id):
+            track = current.track
+            track.resume_at = position
+            try:
+                source = await track.resolve(guild_id=guild_id)
+            finally:
+                track.resume_at = 0.0
+
+            # Пока создавался источник, трек мог закончиться или смениться
+            if self.current.get(guild_id) is not current or not (voice_client.is_playing() or voice_client.is_paused()):
+                source.cleanup()
+                return None
+
+            source.read_stats = current.read_stats
+            # Плеер читает источник без блокировки: старый ffmpeg закроет
+            # первое чтение нового источника, а не этот поток посреди чтения
+            source.replaced_source = current
+            if voice_client.is_paused():
+                # Плеер на паузе источник не читает, а set_source снял бы паузу
+                voice_client._player.source = source
+            else:
+                voice_client.source = source
+            self.current[guild_id] = source
+            self.started_at[guild_id] = time.monotonic()
+
+            # Следующий трек готовим по новой позиции
+            self.cancel_prefetch(guild_id)
+            if source.duration and guild_id not in self.prefetched:
+                self.prefetch_tasks[guild_id] = asyncio.create_task(self.prefetch_next(guild_id, source))
+
+        logger.info(f"Seeked {track.title} to {position:.0f}s in guild {guild_id}")
+        self.save_state(guild_id)
+        await self.update_now_playing(guild_id)
+        return position
+
+    def skip_current(self, guild_id: int) -> bool:
+        """Пропускает текущий трек"""
+        guild = self.bot.get_guild(guild_id)
+        if not guild or not guild.voice_client:
+            return False
+
+        self.skip_requested.add(guild_id)
+        guild.voice_client.stop()
+        return True
+
+    def peek_next(self, guild_id: int) -> Optional[Track]:
+        """Трек, который заиграет после текущего (с учётом режима повтора)"""
+        current = self.current.get(guild_id)
+        repeat = self.repeat_mode.get(guild_id, 'none')
+        queue = self.get_queue(guild_id)
+
+        if current and repeat == 'track':
+            return current.track
+        if queue:
+            return queue[0]
+        if current and repeat == 'queue':
+            return current.track
+        return None
+
+    async def prefetch_next(self, guild_id: int, player: discord.AudioSource):
+        """
+        Фоновая подготовка следующего трека: за PREFETCH_LEAD секунд до конца
+        текущего обновляет ссылку на стрим и заранее запускает FFmpeg,
+        чтобы переключение не ждало extract_info
+        """
+        try:
+            # Ждём почти до конца трека, время на паузе не считаем
+            remaining = player.duration - player.start_offset - PREFETCH_LEAD
+            while remaining > 0:
+                step = min(remaining, 5)
+                await asyncio.sleep(step)
+                guild = self.bot.get_guild(guild_id)
+                voice_client = guild.voice_client if guild else None
+                if not voice_client:
+                    return
+                if not voice_client.is_paused():
+                    remaining -= step
+
+            track = self.peek_next(guild_id)
+            if track is None:
+                return
+
+            await track.refresh(guild_id=guild_id)
+
+            # За время обновления очередь могла измениться
+            if self.current.get(guild_id) is not player or self.peek_next(guild_id) is not track:
+                return
+
+            self.discard_prefetched(guild_id)
+            self.prefetched[guild_id] = await track.resolve(guild_id=guild_id)
+            logger.info(f"Prefetched next track: {track.title} in guild {guild_id}")
+
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"Prefetch failed in guild {guild_id}: {e}")
+        finally:
+            if self.prefetch_tasks.get(guild_id) is asyncio.current_task():
+                del self.prefetch_tasks[guild_id]
+
+    def cancel_prefetch(self, guild_id: int):
+        """Отменяет фоновую предзагрузку следующего трека"""
+        task = self.prefetch_tasks.pop(guild_id, None)
+        if task and task is not asyncio.current_task():
+            task.cancel()
+
+    def discard_prefetched(self, guild_id: int):
+        """Закрывает заранее запущенный FFmpeg, если он больше не нужен"""
+        player = self.prefetched.pop(guild_id, None)
+        if player:
+            player.cleanup()
+
     def start_inactivity_timer(self, guild_id: int):
         """Запускает таймер на отключение при неактивности (10 минут)"""
         self.cancel_inactivity_timer(guild_id)
@@ -268,6 +1005,11 @@ class Music(commands.Cog):
 
         voice_client = guild.voice_client
         if voice_client:
+            # Текущий трек убираем до stop(): handle_track_end не должен записать его ещё раз
+            current = self.current.pop(guild_id, None)
+            if current and (voice_client.is_playing() or voice_client.is_paused()):
+                self.record_history(guild_id, current, completed=False)
+            self.skip_requested.add(guild_id)
             voice_client.stop()
             await voice_client.disconnect()
 
@@ -275,15 +1017,16 @@ class Music(commands.Cog):
         self.queues.pop(guild_id, None)
         self.current.pop(guild_id, None)
         self.repeat_mode.pop(guild_id, None)
+        self.read_stats.pop(guild_id, None)
         self.cancel_inactivity_timer(guild_id)
+        self.cancel_prefetch(guild_id)
+        self.discard_prefetched(guild_id)
+        self.save_state(guild_id)
 
         # Удаляем панель управления
-        if guild_id in self.now_playing_messages:
-            try:
-                await self.now_playing_messages[guild_id].delete()
-            except (discord.NotFound, discord.HTTPException):
-                pass
-            del self.now_playing_messages[guild_id]
+        panel = self.panels.pop(guild_id, None)
+        if panel:
+            await panel.delete()
 
     async def toggle_play_pause(self, guild_id: int):
         """Переключение паузы/воспроизведения"""
@@ -300,19 +1043,14 @@ class Music(commands.Cog):
         elif voice_client.is_paused():
             voice_client.resume()
 
-    async def update_now_playing(self, guild_id: int):
-        """Обновляет embed с текущим треком"""
+    def build_now_playing_embed(self, guild_id: int) -> Optional[discord.Embed]:
+        """Создаёт embed с текущим треком (None, если ничего не играет)"""
         current = self.current.get(guild_id)
         if not current:
-            return
+            return None
 
         guild = self.bot.get_guild(guild_id)
-        if not guild:
-            return
-
-        voice_client = guild.voice_client
-        if not voice_client:
-            return
+        voice_client = guild.voice_client if guild else None
 
         # Создаём embed в стиле Ellen Joe
         embed = discord.Embed(
@@ -322,14 +1060,14 @@ class Music(commands.Cog):
         )
 
         # Статус воспроизведения
-        if voice_client.is_paused():
-            status = "⏸️ Пауза"
-        elif voice_client.is_playing():
-            status = "▶️ Воспроизведение"
-        else:
-            status = "⏹️ Остановлено"
-
-        embed.add_field(name="Статус", value=status, inline=True)
+        if voice_client:
+            if voice_client.is_paused():
+                status = "⏸️ Пауза"
+            elif voice_client.is_playing():
+                status = "▶️ Воспроизведение"
+            else:
+                status = "⏹️ Остановлено"
+            embed.add_field(name="Статус", value=status, inline=True)
 
         # Информация об очереди
         queue_len = len(self.get_queue(guild_id))
@@ -341,27 +1079,26 @@ class Music(commands.Cog):
         embed.add_field(name="Режим", value=f"{repeat_icons[repeat]} {repeat}", inline=True)
 
         embed.set_footer(text="EllenSings • Музыкальный сервис")
+        return embed
 
-        # Создаём или обновляем сообщение
-        view = MusicControls(self, guild_id)
-
-        if guild_id in self.now_playing_messages:
-            try:
-                await self.now_playing_messages[guild_id].edit(embed=embed, view=view)
-            except (discord.NotFound, discord.HTTPException):
-                # Сообщение удалено, создаём новое
-                del self.now_playing_messages[guild_id]
-
-    # ========== КОМАНДЫ ==========
+    async def update_now_playing(self, guild_id: int):
+        """
+        Помечает панель Now Playing устаревшей
 
-    @commands.hybrid_command(name="play", description="Включить музыку")
-    @app_commands.describe(query="Название трека или URL")
-    async def play(self, ctx: commands.Context, *, query: str):
-        """Добавить трек в очередь и начать воспроизведение"""
+        Само редактирование сообщения выполняет NowPlayingPanel
+        не чаще раза в PANEL_UPDATE_INTERVAL секунд.
+        """
+        panel = self.panels.get(guild_id)
+        if panel:
+            panel.mark_dirty()
 
-        # Defer сразу - Discord дает только 3 секунды на ответ
-        await ctx.defer()
+    async def ensure_voice(self, ctx: commands.Context) -> Optional[discord.VoiceClient]:
+        """
+        Проверяет, что пользователь в голосовом канале, и подключается к нему
 
+        Returns:
+            VoiceClient или None (сообщение об ошибке уже отправлено)
+        """
         # Проверка: пользователь в голосовом канале
         if not ctx.author.voice:
             embed = discord.Embed(
@@ -369,7 +1106,8 @@ class Music(commands.Cog):
                 description="Вы должны находиться в голосовом канале",
                 color=0xFF6B6B
             )
-            return await ctx.send(embed=embed, ephemeral=True)
+            await ctx.send(embed=embed, ephemeral=True)
+            return None
 
         # Подключаемся к каналу, если ещё не подключены
         voice_client = ctx.voice_client
@@ -384,21 +1122,51 @@ class Music(commands.Cog):
                     description="Не удалось подключиться к голосовому каналу",
                     color=0xFF6B6B
                 )
-                return await ctx.send(embed=embed)
+                await ctx.send(embed=embed)
+                return None
+
+        return voice_client
+
+    def queue_is_full(self, guild_id: int) -> bool:
+        """Проверка лимита очереди гильдии"""
+        return len(self.get_queue(guild_id)) >= MAX_QUEUE_LENGTH
+
+    # ========== КОМАНДЫ ==========
+
+    @commands.hybrid_command(name="play", description="Включить музыку")
+    @app_commands.describe(query="Название трека или URL")
+    async def play(self, ctx: commands.Context, *, query: str):
+        """Добавить трек в очередь и начать воспроизведение"""
+
+        # Defer сразу - Discord дает только 3 секунды на ответ
+        await ctx.defer()
+
+        if not await self.ensure_voice(ctx):
+            return
+
+        if self.queue_is_full(ctx.guild.id):
+            embed = discord.Embed(
+                title="❌ Очередь заполнена",
+                description=f"В очереди уже {MAX_QUEUE_LENGTH} треков",
+                color=0xFF6B6B
+            )
+            return await ctx.send(embed=embed, ephemeral=True)
 
         # Загрузка трека
 
         try:
-            player = await YTDLSource.from_url(query, loop=self.bot.loop, stream=True)
+            # В очередь кладём только метаданные - FFmpeg запустится перед воспроизведением
+            track = await Track.from_query(query, guild_id=ctx.guild.id)
+            track.requester = ctx.author.id
 
             # Добавляем в очередь
             queue = self.get_queue(ctx.guild.id)
-            queue.append(player)
+            queue.append(track)
 
             # Создаём embed подтверждения
             embed = discord.Embed(
                 title="✅ Добавлено в очередь",
-                description=f"**{player.title}**",
+                description=f"**{track.title}**",
                 color=0x98D8C8
             )
             embed.add_field(name="Позиция", value=f"#{len(queue)}", inline=True)
@@ -418,6 +1186,125 @@ class Music(commands.Cog):
             )
             await ctx.send(embed=embed)
 
+    @play.autocomplete('query')
+    async def play_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        """Подсказки из локального индекса (без запросов к YouTube)"""
+        return [
+            app_commands.Choice(name=title[:100], value=url)
+            for title, url in self.suggestions.suggest(interaction.guild_id, current)
+            if len(url) <= 100
+        ]
+
+    @commands.hybrid_command(name="search", description="Найти трек и выбрать из результатов")
+    @app_commands.describe(query="Название трека")
+    async def search(self, ctx: commands.Context, *, query: str):
+        """Поиск на YouTube с выбором трека из меню"""
+        await ctx.defer()
+
+        if not await self.ensure_voice(ctx):
+            return
+
+        try:
+            results = await search_tracks(query, guild_id=ctx.guild.id)
+        except Exception as e:
+            logger.error(f"Error searching: {e}")
+            embed = discord.Embed(
+                title="❌ Ошибка поиска",
+                description=str(e),
+                color=0xFF6B6B
+            )
+            return await ctx.send(embed=embed)
+
+        if not results:
+            embed = discord.Embed(
+                title="🔎 Ничего не найдено",
+                description=f"По запросу **{query}** нет результатов",
+                color=0xFF6B6B
+            )
+            return await ctx.send(embed=embed, ephemeral=True)
+
+        view = SearchResults(self, ctx.author.id, results)
+        view.message = await ctx.send(embed=view.get_results_embed(query), view=view)
+
+    @commands.hybrid_command(name="playlist", description="Добавить плейлист в очередь")
+    @app_commands.describe(url="Ссылка на плейлист")
+    async def playlist(self, ctx: commands.Context, *, url: str):
+        """Постепенно добавить плейлист в очередь (воспроизведение начинается сразу)"""
+        await ctx.defer()
+
+        if not await self.ensure_voice(ctx):
+            return
+
+        guild_id = ctx.guild.id
+        added = 0
+        skipped = 0
+        playlist_title = None
+        message = None
+
+        try:
+            # aclosing: при выходе из цикла разбор в потоке пула сразу прекращается
+            async with aclosing(iter_playlist(url, limit=MAX_QUEUE_LENGTH)) as batches:
+                async for title, tracks in batches:
+                    # Бот могли остановить, пока плейлист разбирался
+                    if not ctx.voice_client:
+                        break
+
+                    playlist_title = playlist_title or title
+                    queue = self.get_queue(guild_id)
+                    room = max(0, MAX_QUEUE_LENGTH - len(queue))
+                    for track in tracks[:room]:
+                        track.requester = ctx.author.id
+                    queue.extend(tracks[:room])
+                    self.save_state(guild_id)
+                    added += min(room, len(tracks))
+                    skipped += max(0, len(tracks) - room)
+
+                    if message is None:
+                        embed = discord.Embed(
+                            title="📥 Загрузка плейлиста",
+                            description=f"**{playlist_title or url}**\nДобавлено треков: {added}…",
+                            color=0x98D8C8
+                        )
+                        message = await ctx.send(embed=embed)
+                        # Первый трек начинает играть, не дожидаясь остальных
+                        await self.process_queue(guild_id)
+
+                    if room <= len(tracks):
+                        break
+
+        except Exception as e:
+            logger.error(f"Error loading playlist: {e}")
+            if added == 0:
+                embed = discord.Embed(
+                    title="❌ Ошибка загрузки",
+                    description=str(e),
+                    color=0xFF6B6B
+                )
+                return await ctx.send(embed=embed)
+
+        if added == 0 and message is None:
+            embed = discord.Embed(
+                title="❌ Ошибка загрузки",
+                description="Плейлист пуст, недоступен или очередь заполнена",
+                color=0xFF6B6B
+            )
+            return await ctx.send(embed=embed)
+
+        embed = discord.Embed(
+            title="✅ Плейлист добавлен",
+            description=f"**{playlist_title or url}**",
+            color=0x98D8C8
+        )
+        embed.add_field(name="Добавлено", value=f"{added} треков", inline=True)
+        if skipped:
+            embed.add_field(name="Не поместилось", value=f"{skipped} треков", inline=True)
+        embed.set_footer(text="EllenSings")
+
+        try:
+            await message.edit(embed=embed)
+        except (discord.NotFound, discord.HTTPException):
+            await ctx.send(embed=embed)
+
     @commands.hybrid_command(name="skip", description="Пропустить текущий трек")
     async def skip(self, ctx: commands.Context):
         """Пропуск текущего трека"""
@@ -439,7 +1326,7 @@ class Music(commands.Cog):
             )
             return await ctx.send(embed=embed, ephemeral=True)
 
-        voice_client.stop()
+        self.skip_current(ctx.guild.id)
 
         embed = discord.Embed(
             title="⏭️ Трек пропущен",
@@ -447,6 +1334,67 @@ class Music(commands.Cog):
         )
         await ctx.send(embed=embed)
 
+    async def send_seek_result(self, ctx: commands.Context, position: Optional[float], icon: str):
+        """Ответ на перемотку"""
+        if position is None:
+            embed = discord.Embed(
+                title="❌ Ошибка",
+                description="Сейчас ничего не играет",
+                color=0xFF6B6B
+            )
+            return await ctx.send(embed=embed, ephemeral=True)
+
+        current = self.current.get(ctx.guild.id)
+        description = format_timestamp(position)
+        if current and current.duration:
+            description += f" / {format_timestamp(current.duration)}"
+
+        embed = discord.Embed(
+            title=f"{icon} Перемотано",
+            description=description,
+            color=0x5BCEFA
+        )
+        await ctx.send(embed=embed)
+
+    @commands.hybrid_command(name="seek", description="Перемотать текущий трек")
+    @app_commands.describe(timestamp="Время: секунды, мм:сс или чч:мм:сс")
+    async def seek(self, ctx: commands.Context, timestamp: str):
+        """Перемотка на указанное время"""
+        seconds = parse_timestamp(timestamp)
+        if seconds is None:
+            embed = discord.Embed(
+                title="❌ Ошибка",
+                description="Укажите время в формате `90`, `1:30` или `1:02:03`",
+                color=0xFF6B6B
+            )
+            return await ctx.send(embed=embed, ephemeral=True)
+
+        await ctx.defer()
+        position = await self.seek_current(ctx.guild.id, seconds)
+        await self.send_seek_result(ctx, position, "⏩")
+
+    @commands.hybrid_command(name="forward", description="Перемотать вперёд")
+    @app_commands.describe(seconds="На сколько секунд (по умолчанию 10)")
+    async def forward(self, ctx: commands.Context, seconds: int = SEEK_STEP):
+        """Перемотка вперёд относительно текущей позиции"""
+        await ctx.defer()
+        current = self.current.get(ctx.guild.id)
+        position = None
+        if current:
+            position = await self.seek_current(ctx.guild.id, current.position + abs(seconds))
+        await self.send_seek_result(ctx, position, "⏩")
+
+    @commands.hybrid_command(name="rewind", description="Перемотать назад")
+    @app_commands.describe(seconds="На сколько секунд (по умолчанию 10)")
+    async def rewind(self, ctx: commands.Context, seconds: int = SEEK_STEP):
+        """Перемотка назад относительно текущей позиции"""
+        await ctx.defer()
+        current = self.current.get(ctx.guild.id)
+        position = None
+        if current:
+            position = await self.seek_current(ctx.guild.id, current.position - abs(seconds))
+        await self.send_seek_result(ctx, position, "⏪")
+
     @commands.hybrid_command(name="stop", description="Остановить воспроизведение и очистить очередь")
     async def stop(self, ctx: commands.Context):
         """Полная остановка"""
@@ -505,46 +1453,24 @@ class Music(commands.Cog):
     @app_commands.describe()
     async def nowplaying(self, ctx: commands.Context):
         """Показать текущий трек с панелью управления"""
-        current = self.current.get(ctx.guild.id)
+        embed = self.build_now_playing_embed(ctx.guild.id)
 
-        if not current:
+        if embed is None:
             embed = discord.Embed(
                 title="❌ Ничего не играет",
                 color=0xFF6B6B
             )
             return await ctx.send(embed=embed, ephemeral=True)
 
-        voice_client = ctx.voice_client
-
-        embed = discord.Embed(
-            title="🎧 Сейчас играет",
-            description=f"**{current.title}**",
-            color=0x5BCEFA
-        )
+        message = await ctx.send(embed=embed, view=self.controls)
 
-        if voice_client:
-            if voice_client.is_paused():
-                status = "⏸️ Пауза"
-            elif voice_client.is_playing():
-                status = "▶️ Воспроизведение"
-            else:
-                status = "⏹️ Остановлено"
-            embed.add_field(name="Статус", value=status, inline=True)
-
-        queue_len = len(self.get_queue(ctx.guild.id))
-        embed.add_field(name="В очереди", value=f"{queue_len} треков", inline=True)
-
-        repeat = self.repeat_mode.get(ctx.guild.id, 'none')
-        repeat_icons = {'none': '➡️', 'track': '🔂', 'queue': '🔁'}
-        embed.add_field(name="Режим", value=f"{repeat_icons[repeat]} {repeat}", inline=True)
-
-        embed.set_footer(text="EllenSings • Музыкальный сервис")
-
-        view = MusicControls(self, ctx.guild.id)
-        message = await ctx.send(embed=embed, view=view)
-
-        # Сохраняем сообщение для обновлений
-        self.now_playing_messages[ctx.guild.id] = message
+        # Сохраняем сообщение для обновлений, новая панель заменяет старую
+        panel = self.panels.get(ctx.guild.id)
+        if panel:
+            panel.attach(message, embed)
+        else:
+            self.panels[ctx.guild.id] = NowPlayingPanel(self, ctx.guild.id, message, embed)
+        self.save_state(ctx.guild.id)
 
     @commands.hybrid_command(name="clear", description="Очистить очередь")
     async def clear(self, ctx: commands.Context):
@@ -552,6 +1478,7 @@ class Music(commands.Cog):
         queue = self.get_queue(ctx.guild.id)
         cleared = len(queue)
         queue.clear()
+        self.save_state(ctx.guild.id)
 
         embed = discord.Embed(
             title="🗑️ Очередь очищена",
@@ -560,6 +1487,162 @@ class Music(commands.Cog):
         )
         await ctx.send(embed=embed)
 
+    async def send_queue_error(self, ctx: commands.Context, description: str):
+        """Сообщение об ошибке команд редактирования очереди"""
+        embed = discord.Embed(
+            title="❌ Ошибка",
+            description=description,
+            color=0xFF6B6B
+        )
+        await ctx.send(embed=embed, ephemeral=True)
+
+    @commands.hybrid_command(name="remove", description="Удалить трек из очереди")
+    @app_commands.describe(position="Номер трека в очереди")
+    async def remove(self, ctx: commands.Context, position: int):
+        """Удалить трек по номеру из /queue"""
+        queue = self.get_queue(ctx.guild.id)
+        if not 1 <= position <= len(queue):
+            return await self.send_queue_error(ctx, f"В очереди нет трека #{position}")
+
+        track = queue.remove(position - 1)
+        self.save_state(ctx.guild.id)
+
+        embed = discord.Embed(
+            title="🗑️ Удалено из очереди",
+            description=f"**{track.title}**",
+            color=0x95E1D3
+        )
+        await ctx.send(embed=embed)
+        await self.update_now_playing(ctx.guild.id)
+
+    @commands.hybrid_command(name="move", description="Переместить трек в очереди")
+    @app_commands.describe(source="Номер трека", target="Новая позиция")
+    async def move(self, ctx: commands.Context, source: int, target: int):
+        """Переместить трек на другую позицию"""
+        queue = self.get_queue(ctx.guild.id)
+        if not 1 <= source <= len(queue) or not 1 <= target <= len(queue):
+            return await self.send_queue_error(ctx, f"Позиции должны быть от 1 до {len(queue)}")
+
+        track = queue.move(source - 1, target - 1)
+        self.save_state(ctx.guild.id)
+
+        embed = discord.Embed(
+            title="↕️ Трек перемещён",
+            description=f"**{track.title}**\n#{source} → #{target}",
+            color=0x5BCEFA
+        )
+        await ctx.send(embed=embed)
+
+    @commands.hybrid_command(name="shuffle", description="Перемешать очередь")
+    async def shuffle(self, ctx: commands.Context):
+        """Перемешать очередь (текущий трек не затрагивается)"""
+        queue = self.get_queue(ctx.guild.id)
+        if len(queue) < 2:
+            return await self.send_queue_error(ctx, "В очереди недостаточно треков")
+
+        queue.shuffle()
+        self.save_state(ctx.guild.id)
+
+        embed = discord.Embed(
+            title="🔀 Очередь перемешана",
+            description=f"Треков в очереди: {len(queue)}",
+            color=0x5BCEFA
+        )
+        await ctx.send(embed=embed)
+
+    @commands.hybrid_command(name="skipto", description="Перейти к треку в очереди")
+    @app_commands.describe(position="Номер трека в очереди")
+    async def skipto(self, ctx: commands.Context, position: int):
+        """Пропустить все треки до указанного и включить его"""
+        guild_id = ctx.guild.id
+        queue = self.get_queue(guild_id)
+        if not 1 <= position <= len(queue):
+            return await self.send_queue_error(ctx, f"В очереди нет трека #{position}")
+
+        skipped = queue.skip_to(position - 1)
+        track = queue[0]
+
+        # Текущий трек не должен вернуться в начало очереди по повтору трека
+        voice_client = ctx.voice_client
+        current = self.current.get(guild_id)
+        playing = voice_client is not None and (voice_client.is_playing() or voice_client.is_paused())
+        if self.repeat_mode.get(guild_id, 'none') == 'queue':
+            # При повторе очереди текущий и пропущенные треки сыграют на следующем круге
+            queue.extend(([current.track] if current and playing else []) + skipped)
+        self.save_state(guild_id)
+
+        if playing:
+            self.jump_requested.add(guild_id)
+            self.skip_current(guild_id)
+        else:
+            await self.process_queue(guild_id)
+
+        embed = discord.Embed(
+            title="⏭️ Переход к треку",
+            description=f"**{track.title}**\nПропущено треков: {len(skipped)}",
+            color=0x5BCEFA
+        )
+        await ctx.send(embed=embed)
+
+    @commands.hybrid_command(name="top", description="Самые популярные треки сервера")
+    @app_commands.describe(days="За сколько последних дней (по умолчанию за всё время)")
+    async def top(self, ctx: commands.Context, days: Optional[int] = None):
+        """Самые частые треки гильдии по истории прослушиваний"""
+        await ctx.defer()
+
+        since = time.time() - days * 24 * 3600 if days and days > 0 else None
+        rows = await self.history.top(ctx.guild.id, limit=10, since=since)
+        if not rows:
+            embed = discord.Embed(
+                title="🏆 Популярное",
+                description="*История прослушиваний пуста*",
+                color=0x5BCEFA
+            )
+            return await ctx.send(embed=embed)
+
+        embed = discord.Embed(
+            title="🏆 Популярное",
+            description="\n".join(
+                f"`{i}.` {f'[{title}]({url})' if url else title} — ×{plays}"
+                + (f" (до конца: {completed})" if completed != plays else "")
+                for i, (title, url, plays, completed) in enumerate(rows, 1)
+            ),
+            color=0x5BCEFA
+        )
+        embed.set_footer(text=f"EllenSings • {f'за {days} дн.' if since else 'за всё время'}")
+        await ctx.send(embed=embed)
+
+    @commands.hybrid_command(name="history", description="Недавно игравшие треки")
+    async def history_cmd(self, ctx: commands.Context):
+        """Последние воспроизведения гильдии"""
+        await ctx.defer()
+
+        rows = await self.history.recent(ctx.guild.id, limit=10)
+        if not rows:
+            embed = discord.Embed(
+                title="🕘 История",
+                description="*История прослушиваний пуста*",
+                color=0x5BCEFA
+            )
+            return await ctx.send(embed=embed)
+
+        lines = []
+        for title, url, requester, started, ended, completed in rows:
+            line = f"<t:{started}:R> {f'[{title}]({url})' if url else title}"
+            if requester:
+                line += f" — <@{requester}>"
+            if not completed:
+                line += " ⏭️"
+            lines.append(line)
+
+        embed = discord.Embed(
+            title="🕘 История",
+            description="\n".join(lines),
+            color=0x5BCEFA
+        )
+        embed.set_footer(text="EllenSings • ⏭️ пропущен")
+        await ctx.send(embed=embed)
+
     @commands.hybrid_command(name="repeat", description="Установить режим повтора")
     @app_commands.describe(mode="Режим: none, track, queue")
     @app_commands.choices(mode=[
@@ -585,6 +1668,7 @@ class Music(commands.Cog):
             return await ctx.send(embed=embed, ephemeral=True)
 
         self.repeat_mode[ctx.guild.id] = mode
+        self.save_state(ctx.guild.id)
 
         mode_names = {
             'none': '➡️ Без повтора',
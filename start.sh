@@ -40,5 +40,8 @@ echo "=========================================="
 echo "Starting Discord bot..."
 echo ""
 
-# Запуск бота
+# Запуск бота (при SHARD_PROCESSES > 1 bot.py запускает супервизор кластера шардов)
+if [ "${SHARD_PROCESSES:-1}" -gt 1 ]; then
+    echo "Shard cluster: ${SHARD_PROCESSES} processes, ${SHARD_COUNT:-recommended} shards"
+fi
 exec python -u bot.py
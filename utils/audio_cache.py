@@ -0,0 +1,267 @@
+"""
+Локальный кэш аудиофайлов для часто играемых треков
+Хранит готовые Opus/Ogg файлы, которые воспроизводятся без сети и без перекодирования
+"""
+import asyncio
+import os
+import re
+import time
+import logging
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger('audio_cache')
+
+# Папка с файлами кэша
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', 'data/audio')
+# Ограничения размера кэша (0 файлов - кэш выключен)
+AUDIO_CACHE_MAX_BYTES = int(os.getenv('AUDIO_CACHE_MAX_MB', 2048)) * 1024 * 1024
+AUDIO_CACHE_MAX_FILES = int(os.getenv('AUDIO_CACHE_MAX_FILES', 500))
+# После скольких воспроизведений трек считается "горячим" и скачивается
+AUDIO_CACHE_HOT_PLAYS = int(os.getenv('AUDIO_CACHE_HOT_PLAYS', 3))
+# Длинные треки (миксы, подкасты) не кэшируем
+AUDIO_CACHE_MAX_DURATION = 20 * 60
+# Как часто проверять лимиты в фоне (секунды)
+EVICTION_INTERVAL = 600
+# Одновременных загрузок в кэш
+MAX_DOWNLOADS = 2
+# Недокачанные файлы старше этого (секунды) удаляются при сканировании
+STALE_PART_AGE = 60 * 60
+
+
+class AudioCache:
+    """
+    LRU-кэш Opus/Ogg файлов на диске
+
+    Ключ - `extractor_key:id` трека и громкость, с которой файл закодирован
+    (громкость "запекается" в файл, чтобы при воспроизведении делать codec copy).
+    Скачивание выполняет отдельный процесс ffmpeg в фоне. Папку могут
+    делить несколько процессов бота (кластер шардов): временные файлы
+    у каждого процесса свои, готовый файл появляется атомарно. Лимиты
+    относятся ко всей папке: после каждой загрузки индекс перечитывается
+    с диска вместе с файлами других процессов и только потом вытесняется.
+    """
+
+    def __init__(self, directory, *, max_bytes=AUDIO_CACHE_MAX_BYTES, max_files=AUDIO_CACHE_MAX_FILES,
+                 hot_plays=AUDIO_CACHE_HOT_PLAYS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.hot_plays = hot_plays
+        self._files = OrderedDict()  # имя файла -> размер, от давно использованных к недавним
+        self._size = 0
+        self._plays = Counter()
+        self._downloads = {}
+        self._download_slots = asyncio.Semaphore(MAX_DOWNLOADS)
+        self._eviction_task = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_files > 0 and self.max_bytes > 0
+
+    @staticmethod
+    def filename(track_key, volume):
+        """Имя файла кэша для трека и громкости"""
+        safe_key = re.sub(r'[^A-Za-z0-9_.-]', '_', track_key)
+        return f"{safe_key}.v{round(volume * 100)}.ogg"
+
+    def _scan(self):
+        """
+        Читает индекс с диска (в потоке, состояние кэша не трогает)
+
+        Returns:
+            tuple: (OrderedDict имя -> размер, давно использованные первыми; общий размер)
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Файл переименовал или вытеснил другой процесс
+                continue
+            if entry.name.endswith('.part'):
+                # Брошенная загрузка (свежие может качать другой процесс)
+                if now - stat.st_mtime > STALE_PART_AGE:
+                    os.remove(entry.path)
+                continue
+            entries.append((stat.st_mtime, entry.name, stat.st_size))
+
+        entries.sort()
+        files = OrderedDict((name, size) for _, name, size in entries)
+        return files, sum(files.values())
+
+    async def start(self):
+        """Загружает индекс и запускает фоновое вытеснение"""
+        if not self.enabled or self._eviction_task is not None:
+            return
+
+        loop = asyncio.get_running_loop()
+        self._files, self._size = await loop.run_in_executor(None, self._scan)
+        logger.info(f"Audio cache: {len(self._files)} files, {self._size // (1024 * 1024)} MB in {self.directory}")
+        self._eviction_task = asyncio.create_task(self._eviction_loop())
+
+    def lookup(self, track_key, volume):
+        """
+        Возвращает путь к готовому файлу или None
+
+        Обращение обновляет позицию файла в LRU.
+        """
+        if not self.enabled or not track_key:
+            return None
+
+        name = self.filename(track_key, volume)
+        if name not in self._files:
+            self.misses += 1
+            return None
+
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            # Файл удалили снаружи
+            self._size -= self._files.pop(name)
+            self.misses += 1
+            return None
+
+        self._files.move_to_end(name)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return path
+
+    def note_play(self, track_key, data, volume):
+        """
+        Учитывает воспроизведение трека; горячие треки скачиваются в фоне
+
+        Args:
+            track_key: Ключ трека (`extractor_key:id`)
+            data: info dict со свежей ссылкой на стрим
+            volume: Громкость, с которой трек воспроизводится
+        """
+        if not self.enabled or not track_key:
+            return
+
+        self._plays[track_key] += 1
+        if self._plays[track_key] < self.hot_plays:
+            return
+
+        name = self.filename(track_key, volume)
+        if name in self._files or name in self._downloads:
+            return
+
+        duration = data.get('duration') or 0
+        if data.get('is_live') or not data.get('url') or not 0 < duration <= AUDIO_CACHE_MAX_DURATION:
+            return
+
+        self._downloads[name] = asyncio.create_task(self._download(name, data, volume))
+
+    def seed_plays(self, counts):
+        """
+        Переносит число воспроизведений из истории (после перезапуска)
+
+        Args:
+            counts: Пары (track_key, воспроизведений)
+        """
+        for track_key, plays in counts:
+            self._plays[track_key] = max(self._plays[track_key], plays)
+
+    async def _download(self, name, data, volume):
+        """Скачивает трек в Opus/Ogg через ffmpeg"""
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{os.getpid()}.part"
+
+        # Opus без изменения громкости копируем как есть, иначе кодируем один раз здесь
+        if volume == 1.0 and data.get('acodec') == 'opus':
+            codec_args = ['-c:a', 'copy']
+        else:
+            codec_args = ['-af', f'volume={volume}', '-c:a', 'libopus', '-b:a', '128k']
+
+        args = [
+            'ffmpeg', '-nostdin', '-y', '-loglevel', 'error',
+            '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5',
+            '-i', data['url'],
+            '-vn', '-sn', '-dn', '-map_metadata', '-1',
+            *codec_args,
+            '-f', 'ogg', tmp_path
+        ]
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            async with self._download_slots:
+                process = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                _, stderr = await process.communicate()
+
+            if process.returncode != 0:
+                logger.warning(f"Audio cache download failed for {name}: {stderr.decode(errors='replace').strip()}")
+                return
+
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+            self._files[name] = size
+            self._size += size
+            logger.info(f"Cached audio: {data.get('title', name)} ({size // 1024} KB)")
+            await self._refresh()
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Audio cache download failed for {name}: {e}")
+        finally:
+            self._downloads.pop(name, None)
+            if os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def _evict(self):
+        """Удаляет давно использованные файлы, пока кэш не уложится в лимиты"""
+        removed = 0
+        while self._files and (len(self._files) > self.max_files or self._size > self.max_bytes):
+            name, size = self._files.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Failed to evict {name}: {e}")
+            removed += 1
+
+        if removed:
+            logger.info(f"Audio cache evicted {removed} files")
+
+    async def _refresh(self):
+        """Перечитывает папку (её пополняют и другие процессы) и вытесняет лишнее"""
+        loop = asyncio.get_running_loop()
+        # Индекс заменяется уже в event loop, где его меняют lookup и загрузки
+        self._files, self._size = await loop.run_in_executor(None, self._scan)
+        self._evict()
+
+    async def _eviction_loop(self):
+        """Фоновая проверка лимитов (файлы могли меняться снаружи)"""
+        while True:
+            await asyncio.sleep(EVICTION_INTERVAL)
+            try:
+                await self._refresh()
+            except Exception as e:
+                logger.warning(f"Audio cache maintenance failed: {e}")
+
+    def stats(self):
+        """Состояние кэша для диагностики"""
+        return {
+            'files': len(self._files),
+            'bytes': self._size,
+            'downloads': len(self._downloads),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
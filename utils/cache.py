@@ -0,0 +1,424 @@
+"""
+Персистентный кэш результатов yt-dlp
+Хранит info dict треков, чтобы повторные /play не ходили в экстрактор.
+Бэкенд общий для всех процессов кластера: файл SQLite (WAL) или Redis
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger('cache')
+
+# Бэкенд кэша: sqlite (файл на диске) или redis (нужен пакет redis)
+CACHE_BACKEND = os.getenv('YTDL_CACHE_BACKEND', 'sqlite').lower()
+CACHE_PATH = os.getenv('YTDL_CACHE_PATH', 'data/ytdl_cache.sqlite3')
+REDIS_URL = os.getenv('YTDL_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+# Метаданные (название, длительность, автор) живут неделю
+METADATA_TTL = int(os.getenv('YTDL_CACHE_TTL', 7 * 24 * 3600))
+# Максимум треков в кэше, лишние вытесняются по LRU
+MAX_ENTRIES = int(os.getenv('YTDL_CACHE_MAX_ENTRIES', 5000))
+# Как часто (в записях) проверять TTL и лимит размера
+PRUNE_EVERY = 100
+# Результаты /search: сколько живут и сколько запросов помнить
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 6 * 3600))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', 1000))
+
+
+class CacheBackend:
+    """
+    Хранилище кэша метаданных
+
+    Треки хранятся по ключу `extractor_key:id`, запросы пользователей
+    ссылаются на них отдельно. Ссылка на стрим протухает отдельно
+    от метаданных - по времени stream_expires.
+    Методы блокирующие, MetadataCache вызывает их в своём пуле потоков.
+    """
+
+    name = None
+    # Ошибки хранилища, которые не должны ломать воспроизведение
+    errors = ()
+    # Сколько потоков может обращаться к хранилищу одновременно
+    max_workers = 1
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self._stats_lock = threading.Lock()
+
+    def record_lookup(self, hit):
+        """Учитывает обращение: попадание - только запись, которую приняли"""
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, query_key):
+        """
+        Ищет трек по нормализованному запросу или ключу `extractor_key:id`
+
+        Returns:
+            tuple | None: (info, stream_expires) или None при промахе
+        """
+        raise NotImplementedError
+
+    def put(self, query_key, info, stream_expires):
+        """Сохраняет info dict трека и привязывает к нему запрос"""
+        raise NotImplementedError
+
+    def recent(self, limit):
+        """
+        Названия недавно использованных треков (для подсказок /play)
+
+        Returns:
+            list: (track_key, title, webpage_url)
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """Счётчики обращений к бэкенду"""
+        return {
+            'backend': self.name,
+            'hits': self.hits,
+            'misses': self.misses,
+            'failures': self.failures,
+        }
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Кэш в файле SQLite
+
+    WAL позволяет процессам кластера на одной машине читать файл
+    одновременно, пока один из них пишет.
+    """
+
+    name = 'sqlite'
+    errors = (sqlite3.Error,)
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Другой процесс кластера может держать блокировку записи
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tracks (
+                    track_key TEXT PRIMARY KEY,
+                    info TEXT NOT NULL,
+                    stream_expires REAL NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS tracks_accessed ON tracks (accessed);
+                CREATE TABLE IF NOT EXISTS queries (
+                    query_key TEXT PRIMARY KEY,
+                    track_key TEXT NOT NULL
+                );
+            """)
+            self._conn = conn
+            logger.info(f"Metadata cache opened: {self.path}")
+        return self._conn
+
+    def get(self, query_key):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT t.track_key, t.info, t.stream_expires, t.created FROM queries q '
+                'JOIN tracks t ON t.track_key = q.track_key WHERE q.query_key = ?',
+                (query_key,)
+            ).fetchone()
+            if row is None:
+                row = conn.execute(
+                    'SELECT track_key, info, stream_expires, created FROM tracks WHERE track_key = ?',
+                    (query_key,)
+                ).fetchone()
+
+            if row is None or row[3] + METADATA_TTL < now:
+                return None
+
+            track_key, info, stream_expires, _ = row
+            conn.execute('UPDATE tracks SET accessed = ? WHERE track_key = ?', (now, track_key))
+            conn.commit()
+
+        return json.loads(info), stream_expires
+
+    def put(self, query_key, info, stream_expires):
+        track_key = make_track_key(info)
+        if track_key is None:
+            return
+
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO tracks (track_key, info, stream_expires, created, accessed) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (track_key, json.dumps(info, ensure_ascii=False, default=str), stream_expires, now, now)
+            )
+            if query_key and query_key != track_key:
+                conn.execute(
+                    'INSERT OR REPLACE INTO queries (query_key, track_key) VALUES (?, ?)',
+                    (query_key, track_key)
+                )
+            conn.commit()
+
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self._prune(conn, now)
+
+    def recent(self, limit):
+        with self._lock:
+            conn = self._connect()
+            return conn.execute(
+                "SELECT track_key, json_extract(info, '$.title'), json_extract(info, '$.webpage_url') "
+                'FROM tracks WHERE created >= ? ORDER BY accessed DESC LIMIT ?',
+                (time.time() - METADATA_TTL, limit)
+            ).fetchall()
+
+    def _prune(self, conn, now):
+        """Удаляет устаревшие записи и вытесняет лишние по LRU"""
+        conn.execute('DELETE FROM tracks WHERE created < ?', (now - METADATA_TTL,))
+        conn.execute(
+            'DELETE FROM tracks WHERE track_key IN ('
+            'SELECT track_key FROM tracks ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+            (MAX_ENTRIES,)
+        )
+        conn.execute('DELETE FROM queries WHERE track_key NOT IN (SELECT track_key FROM tracks)')
+        conn.commit()
+        logger.debug("Metadata cache pruned")
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Кэш в Redis (или совместимом сервере)
+
+    Срок жизни и вытеснение отдаются самому серверу: у записей есть TTL,
+    лимит памяти задаётся его maxmemory-policy.
+    """
+
+    name = 'redis'
+    # Битая запись (не JSON) - ошибка хранилища, а не обычный промах
+    errors = (redis.RedisError, ValueError) if redis is not None else (ValueError,)
+    max_workers = 4
+
+    def __init__(self, url, prefix='ytdl:'):
+        super().__init__()
+        self.url = url
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+
+    def get(self, query_key):
+        # Запрос мог и не сохраняться отдельно - тогда это сам ключ трека
+        track_key = self._client.get(f"{self.prefix}q:{query_key}")
+        track_key = track_key.decode() if track_key is not None else query_key
+        raw = self._client.get(f"{self.prefix}t:{track_key}")
+        if raw is None:
+            return None
+
+        try:
+            entry = json.loads(raw)
+            return entry['info'], entry['stream_expires']
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Malformed cache entry {track_key}: {e!r}") from e
+
+    def put(self, query_key, info, stream_expires):
+        track_key = make_track_key(info)
+        if track_key is None:
+            return
+
+        entry = json.dumps({'info': info, 'stream_expires': stream_expires}, ensure_ascii=False, default=str)
+        pipe = self._client.pipeline(transaction=False)
+        pipe.set(f"{self.prefix}t:{track_key}", entry, ex=METADATA_TTL)
+        if query_key and query_key != track_key:
+            pipe.set(f"{self.prefix}q:{query_key}", track_key, ex=METADATA_TTL)
+        pipe.execute()
+
+    def recent(self, limit):
+        # У Redis нет порядка по обращениям - берём первые попавшиеся записи
+        keys = []
+        for key in self._client.scan_iter(match=f"{self.prefix}t:*", count=500):
+            keys.append(key)
+            if len(keys) >= limit:
+                break
+
+        rows = []
+        for key, raw in zip(keys, self._client.mget(keys) if keys else ()):
+            if raw is None:
+                continue
+            info = json.loads(raw)['info']
+            rows.append((key.decode()[len(self.prefix) + 2:], info.get('title'), info.get('webpage_url')))
+        return rows
+
+
+def create_backend(kind=None):
+    """Бэкенд кэша по настройке YTDL_CACHE_BACKEND"""
+    kind = kind or CACHE_BACKEND
+    if kind == 'redis':
+        if redis is not None:
+            logger.info(f"Metadata cache uses Redis: {REDIS_URL}")
+            return RedisCacheBackend(REDIS_URL)
+        logger.warning("YTDL_CACHE_BACKEND=redis, but the redis package is not installed - using SQLite")
+    elif kind != 'sqlite':
+        logger.warning(f"Unknown YTDL_CACHE_BACKEND={kind!r} - using SQLite")
+    return SQLiteCacheBackend(CACHE_PATH)
+
+
+class MetadataCache:
+    """
+    Кэш info dict поверх выбранного бэкенда
+
+    Все обращения к бэкенду идут через собственный пул потоков, не блокируя
+    event loop. Ошибки хранилища считаются промахом: без кэша бот работает,
+    просто чаще ходит в экстрактор.
+    """
+
+    def __init__(self, backend, *, flights=None):
+        self.backend = backend
+        # Одинаковые одновременные промахи ждут одну загрузку (SingleFlight)
+        self.flights = flights
+        self._executor = ThreadPoolExecutor(max_workers=backend.max_workers, thread_name_prefix='ytdl-cache')
+
+    @property
+    def hits(self):
+        return self.backend.hits
+
+    @property
+    def misses(self):
+        return self.backend.misses
+
+    def stats(self):
+        return self.backend.stats()
+
+    async def aget(self, query_key):
+        """Ищет трек в кэше, см. CacheBackend.get()"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self.backend.get, query_key)
+        except self.backend.errors as e:
+            self.backend.failures += 1
+            logger.warning(f"Metadata cache read failed: {e}")
+            return None
+
+    async def aput(self, query_key, info, stream_expires):
+        """Сохраняет трек в кэш, см. CacheBackend.put()"""
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self.backend.put, query_key, info, stream_expires)
+        except self.backend.errors as e:
+            self.backend.failures += 1
+            logger.warning(f"Metadata cache write failed: {e}")
+
+    async def recent(self, limit):
+        """Недавние треки из кэша, см. CacheBackend.recent()"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self.backend.recent, limit)
+        except self.backend.errors as e:
+            self.backend.failures += 1
+            logger.warning(f"Metadata cache scan failed: {e}")
+            return []
+
+    async def read_through(self, query_key, load, *, expires, accept=None, use_cache=True):
+        """
+        Возвращает info dict из кэша, а при промахе загружает и сохраняет его
+
+        Args:
+            query_key: Нормализованный запрос
+            load: Корутина-фабрика, которая извлекает info dict
+            expires: Функция info -> время, до которого годна ссылка на стрим
+            accept: Функция (info, stream_expires) -> info | None, решает,
+                подходит ли запись из кэша (None - загрузить заново)
+            use_cache: Искать запись в кэше (False - только обновить её)
+
+        Returns:
+            dict: info dict трека
+        """
+        if use_cache:
+            cached = await self.aget(query_key)
+            data = None
+            if cached is not None:
+                data = accept(*cached) if accept else cached[0]
+            # Запись, которую отверг accept (протухла ссылка), - тоже промах
+            self.backend.record_lookup(data is not None)
+            if data is not None:
+                return data
+
+        async def load_and_store():
+            data = await load()
+            await self.aput(query_key, data, expires(data))
+            return data
+
+        if self.flights is None:
+            return await load_and_store()
+        return dict(await self.flights.run(query_key, load_and_store))
+
+
+class SearchCache:
+    """
+    Результаты поиска в памяти процесса: запрос -> список плоских записей
+
+    Записи лёгкие (id, название, длительность), поэтому держим их прямо
+    в памяти с TTL и вытеснением по LRU - повторный поиск и подсказки
+    отвечают без обращения к YouTube.
+    """
+
+    def __init__(self, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, query_key):
+        """Результаты поиска или None, если запроса нет или он устарел"""
+        item = self._entries.get(query_key)
+        if item is None or item[0] + self.ttl < time.monotonic():
+            self._entries.pop(query_key, None)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(query_key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, query_key, results):
+        self._entries[query_key] = (time.monotonic(), results)
+        self._entries.move_to_end(query_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def make_track_key(info):
+    """Ключ трека в кэше: `extractor_key:id` (например `Youtube:dQw4w9WgXcQ`)"""
+    extractor = info.get('extractor_key') or info.get('ie_key') or info.get('extractor')
+    track_id = info.get('id')
+    if not extractor or not track_id:
+        return None
+    return f"{extractor}:{track_id}"
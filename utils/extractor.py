@@ -0,0 +1,435 @@
+"""
+Пул извлечения yt-dlp
+Выделенные потоки (или процессы) с собственными экземплярами YoutubeDL
+и честной очередью по гильдиям
+"""
+import asyncio
+import itertools
+import os
+import time
+import threading
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import yt_dlp
+from utils.metrics import extraction_seconds, extraction_wait_seconds
+
+logger = logging.getLogger('extractor')
+
+# Где выполнять извлечение: 'thread' - потоки, 'process' - отдельные процессы
+# (разбор страниц и подписей плеера не конкурирует за GIL с голосом и event loop)
+EXTRACT_BACKEND = os.getenv('YTDL_BACKEND', 'thread').lower()
+# Количество потоков (процессов) извлечения
+EXTRACT_WORKERS = int(os.getenv('YTDL_WORKERS', 4))
+# Сколько запросов может ждать в очереди пула (дальше - ожидание)
+MAX_PENDING = int(os.getenv('YTDL_MAX_PENDING', 64))
+# Сколько запросов одной гильдии может ждать в очереди
+MAX_PENDING_PER_GUILD = int(os.getenv('YTDL_MAX_PENDING_PER_GUILD', 8))
+# Сколько плейлистов разбирается одновременно (в отдельных потоках, мимо очереди пула)
+PLAYLIST_STREAMS = int(os.getenv('YTDL_PLAYLIST_STREAMS', 2))
+
+# Тяжёлые поля info dict, которые не нужны для воспроизведения
+_HEAVY_INFO_KEYS = (
+    'formats', 'requested_formats', 'thumbnails', 'automatic_captions',
+    'subtitles', 'requested_subtitles', 'heatmap', 'description', 'tags', 'categories'
+)
+
+# У каждого потока (процесса) пула свой YoutubeDL - экстракторы хранят изменяемое состояние
+_local = threading.local()
+
+
+def compact_info(data):
+    """Оставляет в info dict только то, что нужно для очереди и воспроизведения"""
+    data = yt_dlp.YoutubeDL.sanitize_info(data)
+    return {key: value for key, value in data.items() if key not in _HEAVY_INFO_KEYS}
+
+
+def _init_worker(options):
+    """Инициализация потока (процесса) пула: создаёт его собственный YoutubeDL"""
+    _local.options = options
+    _local.ytdl = yt_dlp.YoutubeDL(options)
+
+
+def _flat_ytdl():
+    """YoutubeDL воркера для плоского разбора плейлистов (создаётся по требованию)"""
+    flat = getattr(_local, 'flat_ytdl', None)
+    if flat is None:
+        flat = _local.flat_ytdl = yt_dlp.YoutubeDL({
+            **_local.options,
+            'extract_flat': 'in_playlist',
+            'noplaylist': False,
+        })
+    return flat
+
+
+def _warm_up():
+    """Пустая задача: заставляет пул процессов заранее запустить воркеры"""
+    return os.getpid()
+
+
+def extract_in_worker(query, download=False):
+    """
+    Извлечение внутри потока (процесса) пула
+
+    Возвращает только простые типы, чтобы результат можно было
+    передать из процесса-воркера через pickle.
+
+    Returns:
+        dict: Компактный info dict первого доступного трека
+    """
+    try:
+        data = _local.ytdl.extract_info(query, download=download)
+    except yt_dlp.DownloadError as e:
+        # Исключения yt-dlp держат traceback и логгер и не сериализуются
+        raise yt_dlp.DownloadError(str(e)) from None
+    except Exception as e:
+        raise Exception(str(e)) from None
+
+    if data is None:
+        raise Exception("Не удалось найти трек")
+
+    # Если это плейлист - берём первый трек
+    if 'entries' in data:
+        # Берём первый доступный трек
+        data = next((entry for entry in data['entries'] if entry), None)
+        if data is None:
+            raise Exception("Плейлист пуст или недоступен")
+
+    return compact_info(data)
+
+
+def _flat_entry(entry):
+    """Минимальный info dict из плоской записи плейлиста (без ссылки на стрим)"""
+    return {
+        'id': entry.get('id'),
+        'extractor_key': entry.get('ie_key'),
+        'title': entry.get('title') or 'Unknown',
+        'webpage_url': entry.get('url') or entry.get('webpage_url'),
+        'duration': entry.get('duration'),
+        'uploader': entry.get('uploader') or entry.get('channel') or 'Unknown',
+    }
+
+
+def _iter_entries(entries, page_size):
+    """Записи плейлиста по одной: генератор, список или постраничный PagedList"""
+    if isinstance(entries, yt_dlp.utils.PagedList):
+        for start in itertools.count(0, page_size):
+            page = entries.getslice(start, start + page_size)
+            if not page:
+                return
+            yield from page
+    else:
+        yield from entries
+
+
+def stream_playlist_in_worker(url, limit, batch_size, emit, cancelled):
+    """
+    Плоский разбор плейлиста внутри потока пула, порциями по batch_size
+
+    Записи берутся из одного ленивого генератора экстрактора (process=False),
+    поэтому каждая страница плейлиста загружается ровно один раз, а готовые
+    порции сразу уходят в event loop через emit(title, entries).
+    Разбор прекращается после limit записей или когда выставлен cancelled.
+    """
+    flat = _flat_ytdl()
+    try:
+        data = flat.extract_info(url, download=False, process=False)
+        if data is None:
+            raise Exception("Не удалось найти плейлист")
+
+        if data.get('_type') not in ('playlist', 'multi_video', 'compat_list'):
+            # Одиночный трек или перенаправление - обрабатываем как обычно
+            data = flat.process_ie_result(data, download=False)
+        title = data.get('title')
+
+        if 'entries' not in data:
+            # Ссылка на одиночный трек - отдаём его как плейлист из одной записи
+            emit(title, [_flat_entry({**data, 'url': data.get('webpage_url')})])
+            return
+
+        batch = []
+        count = 0
+        for entry in _iter_entries(data['entries'], batch_size):
+            if cancelled.is_set():
+                return
+            if not entry:
+                continue
+            batch.append(_flat_entry(entry))
+            count += 1
+            if len(batch) >= batch_size:
+                emit(title, batch)
+                batch = []
+            if limit is not None and count >= limit:
+                break
+        if batch:
+            emit(title, batch)
+    except yt_dlp.DownloadError as e:
+        raise yt_dlp.DownloadError(str(e)) from None
+    except Exception as e:
+        raise Exception(str(e)) from None
+
+
+def extract_search_in_worker(query, count):
+    """
+    Плоский поиск на YouTube внутри потока (процесса) пула
+
+    Один лёгкий запрос `ytsearchN:` - только id, названия и длительности,
+    без извлечения форматов найденных треков.
+
+    Returns:
+        list: Компактные записи найденных треков
+    """
+    flat = _flat_ytdl()
+    try:
+        data = flat.extract_info(f'ytsearch{count}:{query}', download=False)
+    except yt_dlp.DownloadError as e:
+        raise yt_dlp.DownloadError(str(e)) from None
+    except Exception as e:
+        raise Exception(str(e)) from None
+
+    entries = (data or {}).get('entries') or []
+    return [_flat_entry(entry) for entry in entries if entry and entry.get('url')]
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов
+
+    Пока извлечение по ключу выполняется, повторные запросы с тем же ключом
+    ждут его результат вместо запуска своего. Отмена одного из ожидающих
+    не прерывает общее извлечение.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key, factory):
+        """
+        Выполняет factory() для ключа или присоединяется к уже идущему вызову
+
+        Args:
+            key: Ключ запроса (например, нормализованный URL)
+            factory: Функция без аргументов, возвращающая корутину
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+            logger.info(f"Coalesced lookup: {key} (saved {self.coalesced} extractions so far)")
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Результат мог никто не забрать, если все ожидающие отменились
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        """Счётчики: запущенные извлечения и присоединившиеся к ним запросы"""
+        return {'leaders': self.leaders, 'coalesced': self.coalesced, 'inflight': len(self._inflight)}
+
+
+class _Job:
+    __slots__ = ('func', 'args', 'future', 'queued_at')
+
+    def __init__(self, func, args, future):
+        self.func = func
+        self.args = args
+        self.future = future
+        self.queued_at = time.perf_counter()
+
+
+class ExtractionPool:
+    """
+    Выделенный пул извлечения
+
+    Запросы раскладываются по очередям гильдий и выдаются потокам по кругу,
+    поэтому гильдия, вставившая десяток ссылок подряд, не задерживает остальных.
+    Очередь ограничена: при переполнении submit() ждёт освобождения места.
+    Разбор плейлиста длится, пока не придёт последняя запись, поэтому идёт
+    в своих потоках и не занимает воркеры одиночных извлечений.
+    """
+
+    def __init__(self, options, *, backend=EXTRACT_BACKEND, workers=EXTRACT_WORKERS,
+                 max_pending=MAX_PENDING, max_pending_per_guild=MAX_PENDING_PER_GUILD,
+                 playlist_streams=PLAYLIST_STREAMS):
+        if backend not in ('thread', 'process'):
+            logger.warning(f"Unknown extraction backend '{backend}', using 'thread'")
+            backend = 'thread'
+        self.options = options
+        self.backend = backend
+        self.workers = workers
+        self.max_pending_per_guild = max_pending_per_guild
+        self.playlist_streams = max(1, playlist_streams)
+        self._executor = None
+        self._stream_executor = None
+        self._streams = asyncio.Semaphore(self.playlist_streams)
+        self._dispatchers = []
+        self._queues = {}
+        self._order = deque()
+        self._capacity = asyncio.Semaphore(max_pending)
+        # Семафор гильдии живёт, пока у неё есть запросы (guild_id -> [семафор, запросов])
+        self._guild_capacity = {}
+        self._ready = asyncio.Condition()
+
+    def _create_executor(self):
+        if self.backend == 'process':
+            # spawn: форк процесса с потоками discord.py и event loop небезопасен
+            return ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.options,)
+            )
+        return ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix='ytdl-worker',
+            initializer=_init_worker,
+            initargs=(self.options,)
+        )
+
+    async def start(self):
+        """Запускает пул заранее, чтобы первый /play не ждал старта воркеров"""
+        if self._executor is not None:
+            return
+        self._ensure_started()
+
+        if self.backend == 'process':
+            loop = asyncio.get_running_loop()
+            pids = await asyncio.gather(*(
+                loop.run_in_executor(self._executor, _warm_up)
+                for _ in range(self.workers)
+            ))
+            logger.info(f"Extraction processes ready: {sorted(set(pids))}")
+
+    def _ensure_started(self):
+        if self._executor is None:
+            self._executor = self._create_executor()
+            logger.info(f"Extraction pool started: {self.workers} {self.backend} workers")
+        if not self._dispatchers:
+            self._dispatchers = [
+                asyncio.create_task(self._dispatch())
+                for _ in range(self.workers)
+            ]
+
+    @property
+    def pending(self):
+        """Количество запросов, ожидающих свободного потока"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def submit_playlist(self, url, limit, batch_size, emit, cancelled):
+        """
+        Потоковый плоский разбор плейлиста
+
+        Порции записей передаются через emit(title, entries) прямо из потока,
+        поэтому разбор всегда идёт в потоке, даже при пуле процессов. Потоки
+        свои (не больше playlist_streams разборов сразу): /play и обновление
+        ссылок других гильдий, как и первый трек самого плейлиста, не ждут
+        конца перебора. Завершается, когда плейлист разобран (или разбор
+        прерван через cancelled).
+        """
+        if self._stream_executor is None:
+            self._stream_executor = ThreadPoolExecutor(
+                max_workers=self.playlist_streams,
+                thread_name_prefix='ytdl-playlist',
+                initializer=_init_worker,
+                initargs=(self.options,)
+            )
+
+        task = stream_playlist_in_worker.__name__
+        queued_at = time.perf_counter()
+        async with self._streams:
+            started = time.perf_counter()
+            extraction_wait_seconds.observe(started - queued_at, task=task)
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._stream_executor, stream_playlist_in_worker, url, limit, batch_size, emit, cancelled
+                )
+            finally:
+                extraction_seconds.observe(time.perf_counter() - started, task=task)
+
+    async def submit_search(self, query, count, *, guild_id=None):
+        """
+        Плоский поиск с учётом очереди гильдии
+
+        Returns:
+            list: Компактные записи найденных треков
+        """
+        return await self.run(extract_search_in_worker, query, count, guild_id=guild_id)
+
+    async def submit(self, query, *, guild_id=None, download=False):
+        """
+        Ставит извлечение в очередь гильдии и ждёт результат
+
+        Returns:
+            dict: Компактный info dict трека
+        """
+        return await self.run(extract_in_worker, query, download, guild_id=guild_id)
+
+    async def run(self, func, *args, guild_id=None):
+        """Выполняет func(*args) в потоке пула с учётом очереди гильдии"""
+        self._ensure_started()
+
+        entry = self._guild_capacity.get(guild_id)
+        if entry is None:
+            entry = self._guild_capacity[guild_id] = [asyncio.Semaphore(self.max_pending_per_guild), 0]
+        entry[1] += 1
+        try:
+            return await self._run_job(entry[0], func, args, guild_id)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._guild_capacity[guild_id]
+
+    async def _run_job(self, guild_capacity, func, args, guild_id):
+        async with guild_capacity, self._capacity:
+            future = asyncio.get_running_loop().create_future()
+            async with self._ready:
+                queue = self._queues.get(guild_id)
+                if queue is None:
+                    queue = self._queues[guild_id] = deque()
+                    self._order.append(guild_id)
+                queue.append(_Job(func, args, future))
+                self._ready.notify()
+
+            return await future
+
+    async def _next_job(self):
+        """Берёт следующий запрос, обходя гильдии по кругу"""
+        async with self._ready:
+            await self._ready.wait_for(lambda: self._order)
+            guild_id = self._order.popleft()
+            queue = self._queues[guild_id]
+            job = queue.popleft()
+            if queue:
+                self._order.append(guild_id)
+            else:
+                del self._queues[guild_id]
+            return job
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._next_job()
+            if job.future.done():
+                continue
+            started = time.perf_counter()
+            extraction_wait_seconds.observe(started - job.queued_at, task=job.func.__name__)
+            try:
+                result = await loop.run_in_executor(self._executor, job.func, *job.args)
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                extraction_seconds.observe(time.perf_counter() - started, task=job.func.__name__)
@@ -0,0 +1,237 @@
+"""
+История прослушиваний
+Каждое воспроизведение - строка в SQLite, записи копятся в памяти и пишутся пачками
+"""
+import asyncio
+import os
+import sqlite3
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('history')
+
+# Файл истории прослушиваний
+HISTORY_PATH = os.getenv('HISTORY_PATH', 'data/history.sqlite3')
+# Как часто сбрасывать накопленные записи на диск (секунды)
+FLUSH_INTERVAL = 5.0
+# Сколько записей копить, прежде чем записать их досрочно
+FLUSH_BATCH_SIZE = 200
+
+
+class HistoryStore:
+    """
+    Журнал воспроизведений (только добавление)
+
+    Название и ссылка трека хранятся один раз в таблице tracks, строка plays
+    содержит лишь целые числа: гильдию, номер трека, автора запроса, время
+    начала и конца, флаг "доиграл до конца". /top за всё время считается
+    только по покрывающему индексу (guild_id, track_id, completed),
+    /history читает конец индекса (guild_id, started). Запись идёт
+    в отдельном потоке пачками.
+    """
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-store')
+        self._pending = []
+        self._full = asyncio.Event()
+        self._track_ids = {}  # track_key -> tracks.id (только в потоке записи)
+        self._flush_task = None
+        self._closed = False
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Файл общий для процессов кластера - ждём, пока другой допишет пачку
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tracks (
+                    id INTEGER PRIMARY KEY,
+                    track_key TEXT NOT NULL UNIQUE,
+                    title TEXT NOT NULL,
+                    url TEXT,
+                    duration INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS plays (
+                    guild_id INTEGER NOT NULL,
+                    track_id INTEGER NOT NULL,
+                    requester INTEGER,
+                    started INTEGER NOT NULL,
+                    ended INTEGER NOT NULL,
+                    completed INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS plays_guild_track ON plays (guild_id, track_id, completed);
+                CREATE INDEX IF NOT EXISTS plays_guild_started ON plays (guild_id, started);
+            """)
+            self._conn = conn
+        return self._conn
+
+    def _track_id(self, conn, track_key, title, url, duration):
+        track_id = self._track_ids.get(track_key)
+        if track_id is None:
+            conn.execute(
+                'INSERT OR IGNORE INTO tracks (track_key, title, url, duration) VALUES (?, ?, ?, ?)',
+                (track_key, title, url, duration)
+            )
+            track_id = conn.execute('SELECT id FROM tracks WHERE track_key = ?', (track_key,)).fetchone()[0]
+            self._track_ids[track_key] = track_id
+        return track_id
+
+    def _write(self, batch):
+        """Записывает пачку воспроизведений одной транзакцией"""
+        conn = self._connect()
+        try:
+            with conn:
+                self._insert(conn, batch)
+        except sqlite3.Error:
+            # Номера треков из откаченной транзакции недействительны
+            self._track_ids.clear()
+            raise
+
+    def _insert(self, conn, batch):
+        conn.executemany(
+            'INSERT INTO plays (guild_id, track_id, requester, started, ended, completed) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [
+                (guild_id, self._track_id(conn, track_key, title, url, duration),
+                 requester, started, ended, completed)
+                for guild_id, track_key, title, url, duration, requester, started, ended, completed in batch
+            ]
+        )
+
+    def _query(self, sql, params):
+        return self._connect().execute(sql, params).fetchall()
+
+    async def _read(self, sql, *params):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self._query, sql, params)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read play history: {e}")
+            return []
+
+    async def open(self):
+        """Запускает фоновую запись"""
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def record(self, guild_id, track_key, title, url, *, duration=None, requester=None,
+               started=None, ended=None, completed=True):
+        """
+        Добавляет воспроизведение в очередь на запись
+
+        Args:
+            track_key: Ключ трека `extractor_key:id`
+            requester: ID пользователя, который поставил трек
+            started, ended: Время начала и конца (unix)
+            completed: Трек доиграл до конца (False - пропущен или остановлен)
+        """
+        if self._closed or not track_key:
+            return
+
+        ended = ended or time.time()
+        self._pending.append((
+            guild_id, track_key, title, url, int(duration) if duration else None, requester,
+            int(started or ended), int(ended), int(completed)
+        ))
+        if len(self._pending) >= FLUSH_BATCH_SIZE:
+            self._full.set()
+
+    async def flush(self):
+        """Записывает накопленные воспроизведения"""
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        self._full.clear()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._write, batch)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to save play history: {e}")
+            self._pending[:0] = batch
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def top(self, guild_id, *, limit=10, since=None):
+        """
+        Самые частые треки гильдии
+
+        Returns:
+            list: (title, url, воспроизведений, доиграно до конца)
+        """
+        where, params = 'guild_id = ?', [guild_id]
+        if since:
+            where += ' AND started >= ?'
+            params.append(int(since))
+        return await self._read(
+            'SELECT t.title, t.url, p.plays, p.completed FROM ('
+            '  SELECT track_id, COUNT(*) AS plays, SUM(completed) AS completed FROM plays'
+            f'  WHERE {where} GROUP BY track_id ORDER BY plays DESC LIMIT ?'
+            ') p JOIN tracks t ON t.id = p.track_id ORDER BY p.plays DESC',
+            *params, limit
+        )
+
+    async def recent(self, guild_id, *, limit=10):
+        """
+        Последние воспроизведения гильдии
+
+        Returns:
+            list: (title, url, requester, started, ended, completed), новые первыми
+        """
+        return await self._read(
+            'SELECT t.title, t.url, p.requester, p.started, p.ended, p.completed FROM plays p '
+            'JOIN tracks t ON t.id = p.track_id WHERE p.guild_id = ? ORDER BY p.started DESC LIMIT ?',
+            guild_id, limit
+        )
+
+    async def play_counts(self, limit):
+        """
+        Число воспроизведений треков по гильдиям (для подсказок /play)
+
+        Returns:
+            list: (guild_id, track_key, title, url, воспроизведений), недавние первыми
+        """
+        return await self._read(
+            'SELECT p.guild_id, t.track_key, t.title, t.url, p.plays FROM ('
+            '  SELECT guild_id, track_id, COUNT(*) AS plays, MAX(started) AS last FROM plays'
+            '  GROUP BY guild_id, track_id ORDER BY last DESC LIMIT ?'
+            ') p JOIN tracks t ON t.id = p.track_id ORDER BY p.last DESC',
+            limit
+        )
+
+    async def popular(self, *, limit=20, since=None):
+        """
+        Самые частые треки всех гильдий (для прогрева кэша)
+
+        Returns:
+            list: (track_key, url, воспроизведений)
+        """
+        return await self._read(
+            'SELECT t.track_key, t.url, p.plays FROM ('
+            '  SELECT track_id, COUNT(*) AS plays FROM plays WHERE started >= ?'
+            '  GROUP BY track_id ORDER BY plays DESC LIMIT ?'
+            ') p JOIN tracks t ON t.id = p.track_id ORDER BY p.plays DESC',
+            int(since or 0), limit
+        )
+
+    async def close(self):
+        """Останавливает фоновую запись и сохраняет оставшиеся записи"""
+        if self._closed:
+            return
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        self._closed = True
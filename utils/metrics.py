@@ -0,0 +1,231 @@
+"""
+Метрики в формате Prometheus
+Счётчики и гистограммы горячих путей плюс локальный HTTP-эндпоинт /metrics
+"""
+import os
+import threading
+import logging
+from bisect import bisect_left
+from aiohttp import web
+
+logger = logging.getLogger('metrics')
+
+# Порт эндпоинта метрик (0 - выключено) и адрес, на котором он слушает
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+# Границы гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{str(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Базовая метрика: имя, описание и значения по наборам меток
+
+    Значения либо обновляются кодом, либо вычисляются при каждом чтении
+    функцией func (число или dict {метки: значение}) - так экспортируются
+    счётчики, которые уже ведут кэши и пулы.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, func=None):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._func = func
+        # Обновления приходят и из потоков плееров discord.py
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """Итератор (суффикс имени, метки, значение)"""
+        if self._func is None:
+            for labels, value in list(self._values.items()):
+                yield '', labels, value
+            return
+
+        value = self._func()
+        if value is None:
+            return
+        if isinstance(value, dict):
+            for labels, item in value.items():
+                yield '', tuple(sorted(labels)), item
+        else:
+            yield '', (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Монотонный счётчик"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Текущее значение"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными границами"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # метки -> [счётчики по корзинам..., сумма, количество]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                yield '_bucket', labels + (('le', _format_value(bound)),), cumulative
+            yield '_sum', labels, series[-2]
+            yield '_count', labels, series[-1]
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        """Регистрирует метрику (повторная регистрация имени заменяет старую)"""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, func=None):
+        return self.register(Counter(name, documentation, func))
+
+    def gauge(self, name, documentation, func=None):
+        return self.register(Gauge(name, documentation, func))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.warning(f"Failed to collect {metric.name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Метрики горячих путей, которые обновляются прямо в коде
+extraction_seconds = registry.histogram(
+    'ytdl_extraction_seconds', 'Time spent in yt-dlp extraction by a pool worker'
+)
+extraction_wait_seconds = registry.histogram(
+    'ytdl_extraction_wait_seconds', 'Time an extraction request waited for a free pool worker'
+)
+voice_underruns = registry.counter(
+    'voice_frame_underruns_total', 'Audio frames that took longer than one frame duration to read'
+)
+# Пополняется пульсом LoopWatchdog
+loop_lag_seconds = registry.histogram(
+    'event_loop_lag_seconds', 'Event loop scheduling lag',
+    buckets=(0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+
+
+def count_child_processes(name):
+    """Количество дочерних процессов с указанным именем (только Linux, иначе None)"""
+    if not os.path.isdir('/proc'):
+        return None
+
+    pid = str(os.getpid())
+    count = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                stat = f.read().decode(errors='replace')
+        except OSError:
+            continue
+        # Формат: pid (comm) state ppid ...
+        comm = stat[stat.find('(') + 1:stat.rfind(')')]
+        fields = stat[stat.rfind(')') + 2:].split()
+        if comm == name and len(fields) > 1 and fields[1] == pid:
+            count += 1
+    return count
+
+
+class MetricsServer:
+    """
+    Локальный HTTP-эндпоинт /metrics
+    """
+
+    def __init__(self, registry=registry, *, host=METRICS_HOST, port=METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def _handle_metrics(self, request):
+        # Коллбеки читают состояние бота, поэтому сбор идёт в event loop
+        body = self.registry.render()
+        return web.Response(text=body, content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def start(self):
+        """Запускает HTTP-сервер"""
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"Metrics endpoint: http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
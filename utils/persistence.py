@@ -0,0 +1,217 @@
+"""
+Сохранение состояния очередей между перезапусками
+Снимки состояния гильдий пишутся в SQLite пачками, вне event loop
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('persistence')
+
+# Файл с состоянием очередей
+STATE_PATH = os.getenv('STATE_PATH', 'data/state.sqlite3')
+# Как часто сбрасывать изменения на диск (секунды)
+FLUSH_INTERVAL = 2.0
+# Как часто сохранять позицию играющих треков (секунды)
+POSITION_SAVE_INTERVAL = 15.0
+
+
+class QueueStore:
+    """
+    Хранилище состояния гильдий (очередь, текущий трек, режим повтора, панель)
+
+    Изменения только помечают гильдию "грязной"; раз в FLUSH_INTERVAL снимки
+    всех изменённых гильдий собираются и записываются одной транзакцией
+    в отдельном потоке. Позиция трека меняется без всяких событий и хранится
+    в отдельной колонке: раз в POSITION_SAVE_INTERVAL и перед закрытием
+    играющим гильдиям обновляется только она, без пересборки очереди.
+    В очереди хранятся info dict треков, а не источники.
+    При старте читается только индекс гильдий - сами очереди загружаются
+    по требованию (load).
+    """
+
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state-store')
+        self._index = {}  # guild_id -> voice_channel_id
+        self._dirty = set()
+        self._snapshot = None
+        self._positions = None
+        self._flush_task = None
+        self._closed = False
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS guild_state (
+                    guild_id INTEGER PRIMARY KEY,
+                    voice_channel_id INTEGER,
+                    state TEXT NOT NULL,
+                    updated REAL NOT NULL,
+                    position REAL
+                )
+            """)
+            # Файлы из версий без отдельной колонки позиции
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(guild_state)')}
+            if 'position' not in columns:
+                conn.execute('ALTER TABLE guild_state ADD COLUMN position REAL')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _read_index(self):
+        conn = self._connect()
+        return dict(conn.execute('SELECT guild_id, voice_channel_id FROM guild_state'))
+
+    def _read(self, guild_id):
+        conn = self._connect()
+        row = conn.execute('SELECT state, position FROM guild_state WHERE guild_id = ?', (guild_id,)).fetchone()
+        if not row:
+            return None
+        state = json.loads(row[0])
+        if row[1] is not None:
+            state['position'] = row[1]
+        return state
+
+    def _write(self, batch):
+        """Записывает пачку снимков одной транзакцией (None - удалить гильдию)"""
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            for guild_id, state in batch.items():
+                if state is None:
+                    conn.execute('DELETE FROM guild_state WHERE guild_id = ?', (guild_id,))
+                else:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO guild_state (guild_id, voice_channel_id, state, updated, position) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (guild_id, state.get('voice_channel_id'),
+                         json.dumps(state, ensure_ascii=False, default=str), now, state.get('position'))
+                    )
+
+    def _write_positions(self, positions):
+        """Обновляет только позиции треков"""
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                'UPDATE guild_state SET position = ?, updated = ? WHERE guild_id = ?',
+                [(position, now, guild_id) for guild_id, position in positions.items()]
+            )
+
+    async def open(self, snapshot, positions=None):
+        """
+        Открывает хранилище и запускает фоновую запись
+
+        Args:
+            snapshot: Функция guild_id -> dict состояния (None - состояние пустое)
+            positions: Функция -> {guild_id: позиция} гильдий с играющим треком
+        """
+        self._snapshot = snapshot
+        self._positions = positions
+        loop = asyncio.get_running_loop()
+        try:
+            self._index = await loop.run_in_executor(self._executor, self._read_index)
+            logger.info(f"State store opened: {len(self._index)} saved guilds")
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open state store: {e}")
+            self._index = {}
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def saved_guilds(self):
+        """Гильдии с сохранённым состоянием: {guild_id: voice_channel_id}"""
+        return dict(self._index)
+
+    async def load(self, guild_id):
+        """Читает сохранённое состояние гильдии (None, если его нет)"""
+        if guild_id not in self._index:
+            return None
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self._read, guild_id)
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Failed to load state of guild {guild_id}: {e}")
+            return None
+
+    def mark_dirty(self, guild_id):
+        """Запланировать сохранение состояния гильдии"""
+        self._dirty.add(guild_id)
+
+    async def flush(self):
+        """Записывает снимки всех изменённых гильдий"""
+        if not self._dirty or self._snapshot is None or self._closed:
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        batch = {guild_id: self._snapshot(guild_id) for guild_id in dirty}
+        for guild_id, state in batch.items():
+            if state is None:
+                self._index.pop(guild_id, None)
+            else:
+                self._index[guild_id] = state.get('voice_channel_id')
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._write, batch)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to save queue state: {e}")
+            self._dirty |= dirty
+
+    async def save_positions(self):
+        """Сохраняет позиции играющих треков, не перезаписывая очереди"""
+        if self._positions is None or self._closed:
+            return
+
+        positions = {}
+        for guild_id, position in self._positions().items():
+            if guild_id in self._dirty:
+                # Полный снимок всё равно будет записан, позиция войдёт в него
+                continue
+            if guild_id not in self._index:
+                self._dirty.add(guild_id)
+                continue
+            positions[guild_id] = position
+        if not positions:
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._write_positions, positions)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to save playback positions: {e}")
+
+    async def _flush_loop(self):
+        last_positions = time.monotonic()
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            if time.monotonic() - last_positions >= POSITION_SAVE_INTERVAL:
+                last_positions = time.monotonic()
+                await self.save_positions()
+            await self.flush()
+
+    async def close(self):
+        """
+        Останавливает фоновую запись и сохраняет последние изменения
+
+        После закрытия изменения больше не пишутся: при остановке бота
+        отключение от голосовых каналов не должно затереть сохранённые сессии.
+        """
+        if self._closed:
+            return
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.save_positions()
+        await self.flush()
+        self._closed = True
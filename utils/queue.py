@@ -0,0 +1,101 @@
+"""
+Очередь треков гильдии
+deque с операциями O(1) на концах и кэшированной суммарной длительностью
+"""
+import random
+from collections import deque
+from itertools import islice
+
+
+class GuildQueue:
+    """
+    Очередь треков (Track) одной гильдии
+
+    Взятие следующего трека и возврат трека в начало (повтор) выполняются
+    за O(1), в отличие от list.pop(0)/insert(0). Суммарная длительность
+    пересчитывается при каждом изменении, поэтому embed очереди не обходит
+    все треки. Позиции - с нуля.
+    """
+
+    __slots__ = ('_tracks', '_duration')
+
+    def __init__(self, tracks=()):
+        self._tracks = deque()
+        self._duration = 0
+        self.extend(tracks)
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def __bool__(self):
+        return bool(self._tracks)
+
+    def __iter__(self):
+        return iter(self._tracks)
+
+    def __getitem__(self, index):
+        return self._tracks[index]
+
+    @property
+    def total_duration(self):
+        """Суммарная длительность треков в очереди (секунды)"""
+        return self._duration
+
+    def append(self, track):
+        """Добавить трек в конец"""
+        self._tracks.append(track)
+        self._duration += track.duration
+
+    def appendleft(self, track):
+        """Добавить трек в начало (сыграет следующим)"""
+        self._tracks.appendleft(track)
+        self._duration += track.duration
+
+    def extend(self, tracks):
+        """Добавить треки в конец"""
+        for track in tracks:
+            self.append(track)
+
+    def prepend(self, tracks):
+        """Добавить треки в начало, сохранив их порядок"""
+        for track in reversed(tracks):
+            self.appendleft(track)
+
+    def popleft(self):
+        """Взять следующий трек"""
+        track = self._tracks.popleft()
+        self._duration -= track.duration
+        return track
+
+    def remove(self, index):
+        """Удалить трек по позиции и вернуть его"""
+        track = self._tracks[index]
+        # del у deque сдвигает ближайший к позиции конец
+        del self._tracks[index]
+        self._duration -= track.duration
+        return track
+
+    def move(self, source, target):
+        """Переместить трек с позиции source на позицию target"""
+        track = self._tracks[source]
+        del self._tracks[source]
+        self._tracks.insert(target, track)
+        return track
+
+    def shuffle(self):
+        """Перемешать очередь"""
+        tracks = list(self._tracks)
+        random.shuffle(tracks)
+        self._tracks = deque(tracks)
+
+    def skip_to(self, index):
+        """Убрать все треки до позиции index и вернуть их"""
+        return [self.popleft() for _ in range(min(index, len(self._tracks)))]
+
+    def page(self, start, count):
+        """Треки с позиции start (не больше count) без копирования всей очереди"""
+        return list(islice(self._tracks, start, start + count))
+
+    def clear(self):
+        self._tracks.clear()
+        self._duration = 0
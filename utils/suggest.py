@@ -0,0 +1,145 @@
+"""
+Подсказки для /play
+Индекс названий треков в памяти: по триграммам и истории прослушиваний гильдий
+"""
+import asyncio
+import heapq
+import os
+import re
+import logging
+from collections import OrderedDict, Counter
+
+logger = logging.getLogger('suggest')
+
+# Сколько треков держать в индексе (лишние вытесняются по LRU)
+SUGGEST_MAX_ENTRIES = int(os.getenv('SUGGEST_MAX_ENTRIES', 20000))
+# Лимит подсказок Discord
+MAX_SUGGESTIONS = 25
+# Сколько записей индексировать за раз, не отдавая управление event loop
+BUILD_CHUNK = 500
+
+_WORD_SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize_title(text):
+    """Название для поиска: нижний регистр, без знаков препинания"""
+    return ' '.join(_WORD_SEPARATORS.split(text.casefold())).strip()
+
+
+def trigrams(text):
+    """Триграммы строки (для строк короче трёх символов - пусто)"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SuggestionIndex:
+    """
+    Индекс для app_commands.autocomplete команды /play
+
+    Каждое слово запроса от трёх символов сужает кандидатов через
+    пересечение множеств триграмм, затем кандидаты проверяются на вхождение
+    всех слов. Выше в выдаче треки, которые чаще играли в этой гильдии.
+    Всё в памяти event loop - подсказка не ходит ни в сеть, ни на диск.
+    """
+
+    def __init__(self, max_entries=SUGGEST_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # track_key -> (название, нормализованное название, URL)
+        self._entries = OrderedDict()
+        self._trigrams = {}
+        self._plays = Counter()
+        self._guild_plays = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, key, title, url, *, touch=True):
+        """Добавляет трек в индекс (touch - освежить позицию уже известного трека в LRU)"""
+        if not key or not title or not url:
+            return
+
+        if key in self._entries:
+            if touch:
+                self._entries.move_to_end(key)
+            return
+
+        normalized = normalize_title(title)
+        self._entries[key] = (title, normalized, url)
+        for gram in trigrams(normalized):
+            self._trigrams.setdefault(gram, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, normalized, _ = self._entries.pop(key)
+        for gram in trigrams(normalized):
+            keys = self._trigrams.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._trigrams[gram]
+        self._plays.pop(key, None)
+        for plays in self._guild_plays.values():
+            plays.pop(key, None)
+
+    def record_play(self, guild_id, key, title, url, count=1):
+        """Учитывает прослушивание трека гильдией"""
+        self.add(key, title, url)
+        if key not in self._entries:
+            return
+        self._plays[key] += count
+        self._guild_plays.setdefault(guild_id, Counter())[key] += count
+
+    def suggest(self, guild_id, query, limit=MAX_SUGGESTIONS):
+        """
+        Треки, в названии которых есть все слова запроса
+
+        Returns:
+            list: (название, URL), лучшие совпадения первыми
+        """
+        guild_plays = self._guild_plays.get(guild_id) or Counter()
+        words = normalize_title(query).split()
+
+        if not words:
+            # Пустой запрос - любимые треки гильдии
+            return [self._suggestion(key) for key, _ in guild_plays.most_common(limit)]
+
+        candidates = None
+        for word in words:
+            for gram in trigrams(word):
+                keys = self._trigrams.get(gram)
+                if not keys:
+                    return []
+                candidates = set(keys) if candidates is None else candidates & keys
+        if candidates is None:
+            # Слова короче трёх символов - ищем среди истории гильдии
+            candidates = guild_plays.keys()
+
+        phrase = ' '.join(words)
+
+        def score(key):
+            normalized = self._entries[key][1]
+            return guild_plays[key], normalized.startswith(phrase), self._plays[key]
+
+        matches = (
+            key for key in candidates
+            if all(word in self._entries[key][1] for word in words)
+        )
+        return [self._suggestion(key) for key in heapq.nlargest(limit, matches, key=score)]
+
+    def _suggestion(self, key):
+        title, _, url = self._entries[key]
+        return title, url
+
+    async def build(self, rows):
+        """
+        Наполняет индекс записями (track_key, title, url) от новых к старым
+
+        Уже известные треки не сдвигаются в LRU. Между порциями отдаёт
+        управление, чтобы не задерживать event loop.
+        """
+        for i, (key, title, url) in enumerate(reversed(rows), 1):
+            self.add(key, title, url, touch=False)
+            if i % BUILD_CHUNK == 0:
+                await asyncio.sleep(0)
+        logger.info(f"Suggestion index ready: {len(self._entries)} tracks")
@@ -0,0 +1,178 @@
+"""
+Поиск блокировок event loop
+Сторожевой поток замечает, что loop перестал отвечать, и пишет в лог стек,
+на котором он завис; медленные обработчики логируются с длительностью
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+import traceback
+import logging
+from utils.metrics import registry, loop_lag_seconds
+
+logger = logging.getLogger('watchdog')
+
+# Задержка event loop, после которой пишется стек (мс, 0 - выключено)
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD_MS', 250)) / 1000
+# Обработчики дольше этого (мс) логируются как медленные
+SLOW_OPERATION_THRESHOLD = float(os.getenv('SLOW_OPERATION_MS', 2000)) / 1000
+# Как часто loop отмечается, что жив (секунды)
+HEARTBEAT_INTERVAL = 0.1
+
+loop_stalls = registry.counter(
+    'event_loop_stalls_total', 'Times the event loop was blocked longer than the watchdog threshold'
+)
+operation_seconds = registry.histogram(
+    'music_operation_seconds', 'Duration of music commands and queue handlers'
+)
+
+# Сколько замеряемый обработчик ждал сеть и блокировки (список из одного числа)
+_waited = contextvars.ContextVar('waited', default=None)
+
+
+class LoopWatchdog:
+    """
+    Сторожевой поток event loop
+
+    Loop раз в HEARTBEAT_INTERVAL обновляет отметку времени (call_later,
+    без отдельной задачи), опоздание пульса идёт в гистограмму
+    event_loop_lag_seconds. Поток проверяет отметку: если она не обновлялась
+    дольше порога, loop чем-то занят - поток берёт стек потока loop через
+    sys._current_frames() и пишет его в лог (один раз за зависание).
+    """
+
+    def __init__(self, threshold=LOOP_LAG_THRESHOLD, interval=HEARTBEAT_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self._loop = None
+        self._loop_thread_id = None
+        self._last_beat = 0.0
+        self._reported_beat = None
+        self._handle = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self.stalls = 0
+        self.max_lag = 0.0
+
+    def start(self):
+        """Запускает сторожа (вызывается из потока event loop)"""
+        if self._handle is not None:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._handle = self._loop.call_later(self.interval, self._beat)
+        # Без порога пульс только замеряет задержку, стеки не снимаются
+        if self.threshold <= 0:
+            return
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        logger.info(f"Event loop watchdog started (threshold {self.threshold * 1000:.0f}ms)")
+
+    def stop(self):
+        self._stopped.set()
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+
+    def _beat(self):
+        now = time.monotonic()
+        lag = now - self._last_beat - self.interval
+        loop_lag_seconds.observe(max(0.0, lag))
+        if 0 < self.threshold < lag:
+            self.stalls += 1
+            self.max_lag = max(self.max_lag, lag)
+            loop_stalls.inc()
+            logger.warning(f"Event loop was blocked for {lag * 1000:.0f}ms")
+        self._last_beat = now
+        self._handle = self._loop.call_later(self.interval, self._beat)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            beat = self._last_beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled <= self.threshold or self._reported_beat == beat:
+                continue
+
+            # Снимаем стек, пока loop ещё занят
+            self._reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            logger.warning(f"Event loop blocked for {stalled * 1000:.0f}ms, loop thread stack:\n{stack}")
+
+    def stats(self):
+        """Счётчики для диагностики"""
+        return {'stalls': self.stalls, 'max_lag': self.max_lag}
+
+
+def record_operation(operation, seconds):
+    """Учитывает длительность обработчика и логирует слишком долгие"""
+    operation_seconds.observe(seconds, operation=operation)
+    if seconds > SLOW_OPERATION_THRESHOLD:
+        logger.warning(f"Slow operation: {operation} took {seconds * 1000:.0f}ms")
+
+
+def timed(operation):
+    """
+    Декоратор корутины: замеряет длительность каждого вызова
+
+    Ожидание, отмеченное waiting() или locked(), не входит в длительность:
+    предупреждение о медленной операции говорит о работе в event loop,
+    а не о медленном YouTube.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            waited = [0.0]
+            token = _waited.set(waited)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _waited.reset(token)
+                # Вложенный замер: его ожидание не входит и во внешний
+                outer = _waited.get()
+                if outer is not None:
+                    outer[0] += waited[0]
+                record_operation(operation, time.perf_counter() - started - waited[0])
+        return wrapper
+    return decorator
+
+
+@contextlib.asynccontextmanager
+async def waiting(operation=None):
+    """
+    Ожидание внутри timed-обработчика (сеть, извлечение)
+
+    Вычитается из длительности обработчика; с operation пишется
+    в гистограмму отдельно, без предупреждения о медленной операции.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        waited = _waited.get()
+        if waited is not None:
+            waited[0] += elapsed
+        if operation:
+            operation_seconds.observe(elapsed, operation=operation)
+
+
+@contextlib.asynccontextmanager
+async def locked(lock):
+    """async with lock, но ожидание блокировки не входит в длительность обработчика"""
+    async with waiting():
+        await lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
@@ -6,7 +6,14 @@ import discord
 import yt_dlp
 import asyncio
 import os
+import threading
+import time
 import logging
+from urllib.parse import urlparse, parse_qs
+from utils.cache import MetadataCache, SearchCache, create_backend, make_track_key
+from utils.audio_cache import AudioCache, AUDIO_CACHE_DIR
+from utils.extractor import ExtractionPool, SingleFlight
+from utils.metrics import voice_underruns
 
 logger = logging.getLogger('ytdl')
 
@@ -16,6 +23,100 @@ ffmpeg_options = {
     'options': '-vn -sn -dn -ignore_unknown -loglevel warning'
 }
 
+# FFmpeg опции для файлов из локального кэша (Opus копируется без перекодирования)
+cached_ffmpeg_options = {
+    'options': '-vn -loglevel warning'
+}
+
+# Отдавать Discord готовый Opus из ffmpeg вместо PCM-пути discord.py
+OPUS_PASSTHROUGH = os.getenv('OPUS_PASSTHROUGH', '1').lower() not in ('0', 'false', 'no')
+
+# Громкость воспроизведения по умолчанию
+# Только при 1.0 Opus-стримы передаются в Discord без перекодирования (codec copy),
+# поэтому с OPUS_PASSTHROUGH по умолчанию 1.0, без него - прежние 0.5
+DEFAULT_VOLUME = float(os.getenv('PLAYBACK_VOLUME', 1.0 if OPUS_PASSTHROUGH else 0.5))
+
+
+# Подписанные ссылки на стрим без параметра expire считаем устаревшими через 30 минут
+STREAM_URL_MAX_AGE = 30 * 60
+# Запас по времени: ссылка должна жить до конца трека плюс этот запас
+STREAM_URL_MARGIN = 60
+# Сколько записей плейлиста разбирать за один запрос
+PLAYLIST_BATCH_SIZE = 25
+# Сколько результатов показывает /search (в меню выбора не больше 25)
+SEARCH_RESULTS = min(int(os.getenv('SEARCH_RESULTS', 10)), 25)
+# Длительность одного кадра, который discord.py читает из источника (секунды)
+FRAME_DURATION = 0.02
+
+_YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com')
+
+
+def stream_expires_at(url):
+    """
+    Возвращает время истечения подписанной ссылки на стрим (unix time)
+
+    YouTube и многие CDN кладут его в параметр `expire` запроса.
+    Возвращает None, если ссылка его не содержит.
+    """
+    if not url:
+        return None
+    try:
+        values = parse_qs(urlparse(url).query).get('expire')
+        return float(values[0]) if values else None
+    except (ValueError, TypeError):
+        return None
+
+
+def stream_valid_until(data):
+    """Время, до которого ссылка на стрим из info dict считается рабочей"""
+    url = data.get('url')
+    if not url:
+        return 0
+    expires = stream_expires_at(url)
+    if expires is None:
+        # epoch - время извлечения, его проставляет сам yt-dlp
+        expires = (data.get('epoch') or time.time()) + STREAM_URL_MAX_AGE
+    return expires
+
+
+def seek_options(before_options, start):
+    """
+    Добавляет к before_options перемотку на входе ffmpeg
+
+    -ss перед -i ищет по ключевым кадрам контейнера и не декодирует
+    пропущенную часть, а для стрима запрашивает данные с нужного места.
+    """
+    if not start or start <= 0:
+        return before_options
+    return f"-ss {start:.2f} {before_options or ''}".strip()
+
+
+def normalize_query(query):
+    """
+    Приводит запрос к ключу кэша
+
+    Ссылки на YouTube сводятся к `Youtube:<id>` (совпадает с ключом трека),
+    прочие URL - к URL без фрагмента, текстовые запросы - к `search:<текст>`.
+    """
+    query = query.strip()
+    parsed = urlparse(query)
+
+    if parsed.scheme in ('http', 'https') and parsed.netloc:
+        host = parsed.netloc.lower()
+        video_id = None
+        if host == 'youtu.be':
+            video_id = parsed.path.strip('/').split('/')[0]
+        elif host in _YOUTUBE_HOSTS:
+            if parsed.path == '/watch':
+                video_id = parse_qs(parsed.query).get('v', [None])[0]
+            elif parsed.path.startswith(('/shorts/', '/live/')):
+                video_id = parsed.path.split('/')[2]
+        if video_id:
+            return f"Youtube:{video_id}"
+        return parsed._replace(netloc=host, fragment='').geturl()
+
+    return 'search:' + ' '.join(query.lower().split())
+
 
 def get_ytdl_options():
     """
@@ -26,7 +127,8 @@ def get_ytdl_options():
     """
     # Базовые опции
     options = {
-        'format': 'bestaudio/best',
+        # Opus-форматы (YouTube отдаёт их в WebM) можно играть без перекодирования
+        'format': 'bestaudio[acodec=opus]/bestaudio/best' if OPUS_PASSTHROUGH else 'bestaudio/best',
         'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
         'restrictfilenames': True,
         'noplaylist': True,
@@ -58,91 +160,458 @@ def get_ytdl_options():
     return options
 
 
-# Создаём глобальный экземпляр с текущими опциями
-ytdl = yt_dlp.YoutubeDL(get_ytdl_options())
+# Выделенный пул извлечения
+extraction_pool = ExtractionPool(get_ytdl_options())
+
+# Одинаковые одновременные запросы ждут одно извлечение
+extraction_flights = SingleFlight()
 
+# Готовые Opus-файлы часто играемых треков
+audio_cache = AudioCache(AUDIO_CACHE_DIR)
 
-class YTDLSource(discord.PCMVolumeTransformer):
+# Кэш результатов извлечения (переживает перезапуск, общий для процессов кластера)
+metadata_cache = MetadataCache(create_backend(), flights=extraction_flights)
+
+# Результаты /search по запросам
+search_cache = SearchCache()
+
+
+async def extract_info(query, *, guild_id=None, download=False, metadata_only=False, use_cache=True):
     """
-    Источник аудио из YouTube/других платформ
-    Поддерживает стриминг и прокси
+    Извлекает информацию о треке через yt-dlp (без запуска FFmpeg)
+
+    Args:
+        query: URL или поисковый запрос
+        guild_id: Гильдия, от которой пришёл запрос (для честной очереди пула)
+        download: Скачивать файл (False - только метаданные и URL стрима)
+        metadata_only: Из кэша подойдёт запись с устаревшей ссылкой на стрим
+        use_cache: Искать результат в кэше перед обращением к экстрактору
+
+    Returns:
+        dict: info dict первого доступного трека
     """
+    key = normalize_query(query)
 
-    def __init__(self, source, *, data, volume=0.5):
-        super().__init__(source, volume)
+    def accept(data, stream_expires):
+        deadline = time.time() + (data.get('duration') or 0) + STREAM_URL_MARGIN
+        if stream_expires > deadline:
+            logger.debug(f"Cache hit: {key}")
+            return data
+        if metadata_only:
+            # Ссылка протухла - трек обновит её сам перед воспроизведением
+            data.pop('url', None)
+            logger.debug(f"Cache hit (metadata only): {key}")
+            return data
+        return None
+
+    try:
+        # Извлекаем информацию о треке в выделенном пуле,
+        # одинаковые одновременные запросы ждут один результат
+        if download:
+            data = await extraction_flights.run(
+                (key, download),
+                lambda: extraction_pool.submit(query, guild_id=guild_id, download=True)
+            )
+            return dict(data)
+
+        return await metadata_cache.read_through(
+            key,
+            lambda: extraction_pool.submit(query, guild_id=guild_id),
+            expires=stream_valid_until,
+            accept=accept,
+            use_cache=use_cache
+        )
+
+    except yt_dlp.DownloadError as e:
+        _raise_download_error(e)
+
+    except Exception as e:
+        logger.error(f"Unexpected error in YTDLSource: {e}")
+        raise Exception(f"Не удалось загрузить трек: {str(e)}")
+
+
+def _raise_download_error(e):
+    """Превращает ошибку yt-dlp в понятное пользователю сообщение"""
+    error_msg = str(e)
+    logger.error(f"yt-dlp download error: {error_msg}")
+
+    # Более дружелюбные сообщения об ошибках
+    if "Video unavailable" in error_msg:
+        raise Exception("Видео недоступно или удалено")
+    elif "Private video" in error_msg:
+        raise Exception("Это приватное видео")
+    elif "Sign in" in error_msg:
+        raise Exception("Требуется вход в аккаунт (недоступно)")
+    elif "not available" in error_msg:
+        raise Exception("Контент недоступен в вашем регионе")
+    else:
+        raise Exception(f"Ошибка загрузки: {error_msg}")
+
+
+async def iter_playlist(url, *, limit=None, batch_size=PLAYLIST_BATCH_SIZE):
+    """
+    Постепенно разбирает плейлист (extract_flat), порциями по batch_size
+
+    Плейлист перебирается одним потоком пула по ленивому генератору записей:
+    страницы загружаются по одному разу, а порции приходят сюда через
+    asyncio.Queue, поэтому первые треки можно ставить в очередь, пока
+    остальные ещё не получены. Форматы треков здесь не извлекаются - это
+    делает Track.resolve(). Если перебор бросили, разбор в потоке прекращается.
+
+    Args:
+        url: Ссылка на плейлист
+        limit: Максимум записей (None - без ограничения)
+
+    Yields:
+        tuple: (название плейлиста, список Track)
+    """
+    loop = asyncio.get_running_loop()
+    batches = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def emit(title, entries):
+        loop.call_soon_threadsafe(batches.put_nowait, (title, entries))
+
+    job = asyncio.ensure_future(
+        extraction_pool.submit_playlist(url, limit, batch_size, emit, cancelled)
+    )
+    # Порции, отправленные из потока, попадают в очередь раньше этого маркера
+    job.add_done_callback(lambda _: batches.put_nowait(None))
+
+    try:
+        while True:
+            batch = await batches.get()
+            if batch is None:
+                break
+            title, entries = batch
+            yield title, [Track(entry) for entry in entries if entry.get('webpage_url')]
+
+        await job
+
+    except yt_dlp.DownloadError as e:
+        _raise_download_error(e)
+    except Exception as e:
+        logger.error(f"Unexpected error while reading playlist: {e}")
+        raise Exception(f"Не удалось загрузить плейлист: {str(e)}")
+    finally:
+        cancelled.set()
+        if not job.done():
+            job.cancel()
+
+
+async def search_tracks(query, *, guild_id=None, limit=SEARCH_RESULTS):
+    """
+    Ищет треки на YouTube без извлечения форматов (extract_flat)
+
+    Результаты кэшируются по запросу, одинаковые одновременные
+    поиски ждут один запрос.
+
+    Args:
+        query: Поисковый запрос
+        limit: Сколько результатов вернуть
+
+    Returns:
+        list: Плоские записи (id, title, duration, uploader, webpage_url)
+    """
+    key = f"{normalize_query(query)}:{limit}"
+    results = search_cache.get(key)
+    if results is not None:
+        return results
+
+    try:
+        results = await extraction_flights.run(
+            ('search', key),
+            lambda: extraction_pool.submit_search(query.strip(), limit, guild_id=guild_id)
+        )
+    except yt_dlp.DownloadError as e:
+        _raise_download_error(e)
+    except Exception as e:
+        logger.error(f"Unexpected error while searching: {e}")
+        raise Exception(f"Не удалось выполнить поиск: {str(e)}")
+
+    search_cache.put(key, results)
+    return results
+
+
+class Track:
+    """
+    Лёгкое описание трека в очереди: метаданные + способ получить аудио
+
+    FFmpeg-процесс не создаётся, пока трек не понадобится для воспроизведения
+    (см. resolve), поэтому очередь любой длины не держит открытых пайпов.
+    """
+
+    __slots__ = ('data', 'title', 'webpage_url', 'duration', 'thumbnail', 'uploader', 'stale', 'failures',
+                 'resume_at', 'requester')
+
+    def __init__(self, data, *, resume_at=0.0, requester=None):
+        self._apply(data)
+        self.failures = 0
+        # Позиция (секунды), с которой начать следующее воспроизведение
+        self.resume_at = resume_at
+        # ID пользователя, поставившего трек (для истории прослушиваний)
+        self.requester = requester
+
+    @property
+    def key(self):
+        """Ключ трека `extractor_key:id` (None, если неизвестен)"""
+        return make_track_key(self.data)
+
+    def _apply(self, data):
         self.data = data
         self.title = data.get('title', 'Unknown')
-        self.url = data.get('url')
         self.webpage_url = data.get('webpage_url')
-        self.duration = data.get('duration', 0)
+        self.duration = data.get('duration') or 0
         self.thumbnail = data.get('thumbnail')
         self.uploader = data.get('uploader', 'Unknown')
+        self.stale = False
 
     @classmethod
-    async def from_url(cls, url, *, loop=None, stream=True):
+    async def from_query(cls, query, *, guild_id=None):
+        """
+        Находит трек по URL или поисковому запросу (только метаданные)
+
+        Returns:
+            Track: Описание трека для очереди
         """
-        Загружает трек по URL или поисковому запросу
+        data = await extract_info(query, guild_id=guild_id, metadata_only=True)
+        logger.info(f"Loaded track: {data.get('title', 'Unknown')} from {data.get('extractor', 'unknown')}")
+        return cls(data)
 
-        Args:
-            url: URL или поисковый запрос
-            loop: Event loop (опционально)
-            stream: Стриминг (True) или скачивание (False)
+    def mark_stale(self):
+        """Помечает ссылку на стрим нерабочей: следующий resolve получит новую в обход кэша"""
+        self.stale = True
+
+    def needs_refresh(self):
+        """Проверяет, что ссылка на стрим отсутствует или истечёт до конца трека"""
+        if self.stale:
+            return True
+        deadline = time.time() + self.duration + STREAM_URL_MARGIN
+        return stream_valid_until(self.data) <= deadline
+
+    async def refresh(self, *, guild_id=None, force=False):
+        """
+        Заново получает ссылку на стрим, если текущая устарела
 
         Returns:
-            YTDLSource: Готовый источник аудио
+            bool: True, если было выполнено повторное извлечение
         """
-        loop = loop or asyncio.get_event_loop()
+        if not force and not self.needs_refresh():
+            return False
 
-        try:
-            # Извлекаем информацию о треке
-            data = await loop.run_in_executor(
-                None,
-                lambda: ytdl.extract_info(url, download=not stream)
-            )
+        query = self.webpage_url or self.data.get('original_url') or self.data.get('url')
+        data = await extract_info(query, guild_id=guild_id, use_cache=not (force or self.stale))
+        self._apply(data)
+        logger.info(f"Re-resolved stream URL: {self.title}")
+        return True
 
-            if data is None:
-                raise Exception("Не удалось найти трек")
+    async def resolve(self, *, guild_id=None):
+        """
+        Создаёт FFmpeg-источник для воспроизведения трека
 
-            # Если это плейлист - берём первый трек
-            if 'entries' in data:
-                # Берём первый доступный трек
-                data = next((entry for entry in data['entries'] if entry), None)
-                if data is None:
-                    raise Exception("Плейлист пуст или недоступен")
+        Если трек есть в локальном аудиокэше - играет файл без сети и перекодирования.
+        Иначе по возможности отдаёт Discord готовый Opus (OpusStreamSource),
+        а PCM-путь (YTDLSource) остаётся запасным.
+        Воспроизведение начинается с resume_at (после прерывания), позиция
+        после этого сбрасывается.
 
-            # URL для стриминга или имя файла
-            if stream:
-                filename = data['url']
-            else:
-                filename = ytdl.prepare_filename(data)
+        Returns:
+            TrackAudioMixin: Готовый источник аудио
+        """
+        start = self.resume_at
+        path = None if self.stale else audio_cache.lookup(self.key, DEFAULT_VOLUME)
+        if path:
+            logger.info(f"Playing from audio cache: {self.title}")
+            source = CachedOpusSource(path, track=self, start=start)
+        else:
+            await self.refresh(guild_id=guild_id)
+            source = None
+            if OPUS_PASSTHROUGH:
+                try:
+                    source = OpusStreamSource(track=self, start=start)
+                except Exception as e:
+                    logger.warning(f"Opus passthrough unavailable for {self.title}, using PCM: {e}")
+            if source is None:
+                source = YTDLSource.from_track(self, start=start)
 
-            logger.info(f"Loaded track: {data.get('title', 'Unknown')} from {data.get('extractor', 'unknown')}")
+        if start:
+            logger.info(f"Resuming {self.title} at {start:.0f}s")
+        self.resume_at = 0.0
+        return source
 
-            # Создаём FFmpeg источник
-            return cls(
-                discord.FFmpegPCMAudio(filename, **ffmpeg_options),
-                data=data
-            )
+    def __str__(self):
+        return f"{self.title} ({self.uploader})"
+
+
+class ReadStats:
+    """
+    Статистика чтения кадров из ffmpeg для одной гильдии
+
+    Обновляется из потока плеера discord.py (один писатель на гильдию),
+    читается из event loop для !stats.
+    """
+
+    __slots__ = ('reads', 'empty', 'short', 'slow', 'read_time', 'max_read_time', 'bytes', 'since')
+
+    def __init__(self):
+        self.reads = 0
+        self.empty = 0
+        self.short = 0
+        self.slow = 0
+        self.read_time = 0.0
+        self.max_read_time = 0.0
+        self.bytes = 0
+        self.since = time.time()
+
+    def record(self, elapsed, frame, opus):
+        """Учитывает одно чтение: длительность и размер полученного кадра"""
+        self.reads += 1
+        self.read_time += elapsed
+        if elapsed > self.max_read_time:
+            self.max_read_time = elapsed
+        if elapsed > FRAME_DURATION:
+            self.slow += 1
+        if not frame:
+            self.empty += 1
+        elif not opus and len(frame) < discord.opus.Encoder.FRAME_SIZE:
+            self.short += 1
+        self.bytes += len(frame)
+
+    def summary(self):
+        """Сводка: среднее и максимальное время чтения (мс), скорость чтения stdout ffmpeg (КБ/с)"""
+        return {
+            'reads': self.reads,
+            'avg_read_ms': self.read_time / self.reads * 1000 if self.reads else 0.0,
+            'max_read_ms': self.max_read_time * 1000,
+            'slow': self.slow,
+            'empty': self.empty,
+            'short': self.short,
+            # Только время внутри read(): паузы и промежутки между треками не считаются
+            'kbytes_per_sec': self.bytes / self.read_time / 1024 if self.read_time > 0 else 0.0,
+        }
+
+
+class TrackAudioMixin:
+    """
+    Общие поля источников аудио, созданных из трека
+
+    Считает прочитанные кадры: discord.py читает ровно один кадр
+    (FRAME_DURATION) за вызов read(), так что позиция известна без
+    обращения к ffmpeg. Если задан read_stats, каждое чтение в него записывается.
+    replaced_source - источник, который этот подменил в плеере (перемотка):
+    он закрывается при первом чтении нового, когда плеер точно переключился.
+    """
 
-        except yt_dlp.DownloadError as e:
-            error_msg = str(e)
-            logger.error(f"yt-dlp download error: {error_msg}")
-
-            # Более дружелюбные сообщения об ошибках
-            if "Video unavailable" in error_msg:
-                raise Exception("Видео недоступно или удалено")
-            elif "Private video" in error_msg:
-                raise Exception("Это приватное видео")
-            elif "Sign in" in error_msg:
-                raise Exception("Требуется вход в аккаунт (недоступно)")
-            elif "not available" in error_msg:
-                raise Exception("Контент недоступен в вашем регионе")
-            else:
-                raise Exception(f"Ошибка загрузки: {error_msg}")
-
-        except Exception as e:
-            logger.error(f"Unexpected error in YTDLSource: {e}")
-            raise Exception(f"Не удалось загрузить трек: {str(e)}")
+    def _init_track(self, data, track, start=0.0):
+        self.data = data
+        self.start_offset = start
+        self.frames_read = 0
+        self.read_stats = None
+        self.replaced_source = None
+        self.track = track or Track(data)
+        self.title = data.get('title', 'Unknown')
+        self.url = data.get('url')
+        self.webpage_url = data.get('webpage_url')
+        self.duration = data.get('duration', 0)
+        self.thumbnail = data.get('thumbnail')
+        self.uploader = data.get('uploader', 'Unknown')
+
+    def read(self):
+        replaced = self.replaced_source
+        if replaced is not None:
+            self.replaced_source = None
+            replaced.cleanup()
+
+        started = time.perf_counter()
+        frame = super().read()
+        elapsed = time.perf_counter() - started
+        if frame:
+            self.frames_read += 1
+            # Кадр читался дольше, чем длится - плеер отстаёт от реального времени
+            if elapsed > FRAME_DURATION:
+                voice_underruns.inc()
+        stats = self.read_stats
+        if stats is not None:
+            stats.record(elapsed, frame, self.is_opus())
+        return frame
+
+    def cleanup(self):
+        replaced, self.replaced_source = self.replaced_source, None
+        if replaced is not None:
+            replaced.cleanup()
+        super().cleanup()
+
+    @property
+    def position(self):
+        """Текущая позиция воспроизведения в секундах"""
+        return self.start_offset + self.frames_read * FRAME_DURATION
 
     def __str__(self):
         return f"{self.title} ({self.uploader})"
+
+
+class YTDLSource(TrackAudioMixin, discord.PCMVolumeTransformer):
+    """
+    Источник аудио из YouTube/других платформ
+    Поддерживает стриминг и прокси
+    """
+
+    def __init__(self, source, *, data, volume=DEFAULT_VOLUME, track=None, start=0.0):
+        super().__init__(source, volume)
+        self._init_track(data, track, start)
+
+    @classmethod
+    def from_track(cls, track, *, start=0.0):
+        """Создаёт FFmpeg источник из уже извлечённого трека (с позиции start)"""
+        return cls(
+            discord.FFmpegPCMAudio(
+                track.data['url'],
+                before_options=seek_options(ffmpeg_options['before_options'], start),
+                options=ffmpeg_options['options']
+            ),
+            data=track.data,
+            track=track,
+            start=start
+        )
+
+
+class OpusStreamSource(TrackAudioMixin, discord.FFmpegOpusAudio):
+    """
+    Стрим, который ffmpeg сразу отдаёт в Opus
+
+    Opus-поток при громкости 1.0 копируется без декодирования (codec copy).
+    В остальных случаях ffmpeg сам применяет громкость и кодирует в Opus -
+    в процессе бота не остаётся ни PCM, ни покадрового кодирования.
+    """
+
+    def __init__(self, *, track, volume=DEFAULT_VOLUME, start=0.0):
+        data = track.data
+        options = ffmpeg_options['options']
+        if volume == 1.0 and data.get('acodec') == 'opus':
+            codec = 'copy'
+        else:
+            codec = None  # libopus внутри ffmpeg
+            options = f"{options} -af volume={volume}"
+
+        super().__init__(
+            data['url'],
+            codec=codec,
+            before_options=seek_options(ffmpeg_options['before_options'], start),
+            options=options
+        )
+        self._init_track(data, track, start)
+        self.passthrough = codec == 'copy'
+
+
+class CachedOpusSource(TrackAudioMixin, discord.FFmpegOpusAudio):
+    """
+    Источник из локального аудиокэша
+
+    Файл уже закодирован в Opus с нужной громкостью, поэтому ffmpeg только
+    копирует пакеты, а discord.py не декодирует и не кодирует их заново.
+    """
+
+    def __init__(self, path, *, track, start=0.0):
+        super().__init__(path, codec='copy', before_options=seek_options(None, start), **cached_ffmpeg_options)
+        self._init_track(track.data, track, start)
+        self.path = path